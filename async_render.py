@@ -0,0 +1,59 @@
+""" Asyncio front end for rendering invoices """
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from orders import init_worker, prepare_batch, render_invoice_bytes
+
+
+class AsyncRenderer:
+    """Renders invoices to bytes from asyncio code
+
+    Renders run on an executor so the event loop is never blocked, and at
+    most max_concurrency renders are queued or running at once.
+    """
+
+    def __init__(self, max_concurrency=None, executor=None, compiled=True):
+        """Initialize async renderer
+
+        Args:
+            max_concurrency (int): renders in flight at once
+            executor (Executor): where renders run; defaults to a pool of
+                worker processes, warmed after the logo is fetched here once
+            compiled (bool): render on the compiled page template
+        """
+        self.max_concurrency = max_concurrency or os.cpu_count()
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.compiled = compiled
+        self.owns_executor = executor is None
+        if executor is None:
+            prepare_batch(compiled)
+            options = {"compiled": compiled, "folder": None, "logo_checked": True}
+            executor = ProcessPoolExecutor(
+                self.max_concurrency, initializer=init_worker, initargs=(options,)
+            )
+        self.executor = executor
+
+    async def render(self, invoice):
+        """Render an invoice and return the pdf bytes"""
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, render_invoice_bytes, invoice, self.compiled
+            )
+
+    async def render_to(self, invoice, writer):
+        """Render an invoice into an asyncio StreamWriter"""
+        writer.write(await self.render(invoice))
+        await writer.drain()
+
+    def close(self):
+        """Shut down the executor if this renderer created it"""
+        if self.owns_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
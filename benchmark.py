@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+""" Rendering benchmarks
+
+Measures per-invoice latency, batch throughput across process counts,
+scaling with the number of order lines, peak memory and output size, and
+writes the results as JSON so runs can be compared.
+
+    python benchmark.py --invoices 200 --processes 1 2 4 --output bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from invoice import Invoice
+from invoice_pdf import PdfInvoice
+from load_generator import InvoiceGenerator
+from order import Order
+from orders import BatchRenderer
+from product import Product
+
+
+def percentiles(values):
+    """Return the p50, p90 and p99 of a list of values"""
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {"p50": value, "p90": value, "p99": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p90": cuts[89], "p99": cuts[98]}
+
+
+def bench_latency(invoices, folder, compiled):
+    """Render invoices one at a time, timing each
+
+    Returns:
+        dict: latency percentiles in ms, invoices/sec and bytes per invoice
+    """
+    latencies = []
+    sizes = []
+    start = time.perf_counter()
+    for invoice in invoices:
+        t = time.perf_counter()
+        generate = PdfInvoice(invoice, compiled=compiled)
+        generate.folder = folder
+        filename = generate.invoice_to_pdf()
+        latencies.append((time.perf_counter() - t) * 1000)
+        sizes.append(os.path.getsize(filename))
+    elapsed = time.perf_counter() - start
+    return {
+        "compiled": compiled,
+        "invoices": len(invoices),
+        "latency_ms": percentiles(latencies),
+        "invoices_per_sec": len(invoices) / elapsed,
+        "bytes_per_invoice": statistics.mean(sizes),
+    }
+
+
+def bench_throughput(invoices, folder, processes, chunksize):
+    """Render invoices through the process pool
+
+    Returns:
+        dict: invoices/sec and failures for the given process count
+    """
+    renderer = BatchRenderer(processes=processes, chunksize=chunksize, folder=folder)
+    start = time.perf_counter()
+    failures = renderer.run(invoices)
+    elapsed = time.perf_counter() - start
+    return {
+        "processes": processes,
+        "invoices": len(invoices),
+        "invoices_per_sec": len(invoices) / elapsed,
+        "failures": len(failures),
+    }
+
+
+def long_invoice(lines):
+    """Return an invoice with the given number of order lines"""
+    products = [Product(name, price) for name, price in (("Milk", 1.25), ("Eggs", 2.1), ("Bread", 1.5))]
+    base = datetime.date(2022, 5, 1)
+    orders = [
+        Order("Wholesale Customer", 1 + i % 5, base + datetime.timedelta(days=i % 28), products[i % 3])
+        for i in range(lines)
+    ]
+    return Invoice("Wholesale Customer", base, orders)
+
+
+def bench_line_counts(counts, folder, compiled):
+    """Render one invoice per order-line count
+
+    Returns:
+        list: render time, pages and output size per line count
+    """
+    results = []
+    for lines in counts:
+        invoice = long_invoice(lines)
+        start = time.perf_counter()
+        generate = PdfInvoice(invoice, compiled=compiled)
+        generate.folder = folder
+        filename = generate.invoice_to_pdf()
+        results.append({
+            "lines": lines,
+            "seconds": time.perf_counter() - start,
+            "pages": generate.pdf.page,
+            "bytes": os.path.getsize(filename),
+        })
+    return results
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process and its children"""
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+def run(num_invoices, processes, line_counts, chunksize=16):
+    """Run every benchmark and return the results"""
+    invoices = list(InvoiceGenerator(seed=10).invoices(num_invoices))
+    folder = tempfile.mkdtemp(prefix="invoice_bench_")
+    try:
+        return {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sequential": [bench_latency(invoices, folder, compiled) for compiled in (False, True)],
+            "pool": [bench_throughput(invoices, folder, p, chunksize) for p in processes],
+            "line_counts": bench_line_counts(line_counts, folder, compiled=True),
+            "peak_rss_kb": peak_rss_kb(),
+        }
+    finally:
+        shutil.rmtree(folder)
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invoices", type=int, default=100, help="invoices per run")
+    parser.add_argument(
+        "--processes", type=int, nargs="+",
+        default=sorted({1, 2, os.cpu_count()}), help="pool sizes to compare",
+    )
+    parser.add_argument(
+        "--lines", type=int, nargs="+", default=[1, 100, 10000], help="order lines per invoice",
+    )
+    parser.add_argument("--chunksize", type=int, default=16, help="pool chunk size")
+    parser.add_argument("--output", default="bench_output.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    results = run(args.invoices, args.processes, args.lines, args.chunksize)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    for result in results["sequential"]:
+        mode = "compiled" if result["compiled"] else "classic"
+        latency = result["latency_ms"]
+        print(
+            f"sequential {mode:<9} {result['invoices_per_sec']:>8.1f} inv/s "
+            f"p50 {latency['p50']:.2f}ms p99 {latency['p99']:.2f}ms "
+            f"{result['bytes_per_invoice']:.0f} B/inv"
+        )
+    for result in results["pool"]:
+        print(f"pool x{result['processes']:<14} {result['invoices_per_sec']:>8.1f} inv/s")
+    for result in results["line_counts"]:
+        print(f"{result['lines']:>6} lines {result['seconds']:>8.3f}s {result['pages']} pages")
+    print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
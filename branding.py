@@ -0,0 +1,134 @@
+""" Branding configuration shared by every invoice """
+import hashlib
+import os
+import time
+
+# Attribute, file name and fallback value of each text setting
+TEXT_FILES = (
+    ("address", "address.txt", "Address"),
+    ("notes", "notes.txt", "Notes"),
+    ("payment_terms", "payment_terms.txt", "Payment Terms"),
+    ("logo_url", "logo_url.txt", ""),
+)
+
+# Fill colour of each bar of the layout, as (r, g, b)
+DEFAULT_THEME = {
+    "balance_bar": (245, 245, 245),
+    "table_bar": (58, 58, 58),
+}
+
+
+class BrandingConfig:
+    """Business details read from the data folder
+
+    The files are read once. They are only stat'ed again when refresh is
+    called with force=True, or when check_interval seconds have passed since
+    the last check, and only files whose mtime or size changed are re-read.
+    """
+
+    def __init__(self, data_folder="data", images_folder="images", check_interval=None,
+                 theme=None):
+        """Initialize branding config
+
+        Args:
+            data_folder (str): folder holding the text files
+            images_folder (str): folder holding logo.png and main_logo.png
+            check_interval (float): seconds between automatic re-stats;
+                None to only re-stat on refresh(force=True)
+            theme (dict): colours overriding those of DEFAULT_THEME
+        """
+        self.data_folder = data_folder
+        self.images_folder = images_folder
+        self.check_interval = check_interval
+        self.theme = dict(DEFAULT_THEME)
+        for name, color in (theme or {}).items():
+            self.theme[name] = tuple(color)
+        self.logo_path = os.path.join(images_folder, "logo.png")
+        self.main_logo_path = os.path.join(images_folder, "main_logo.png")
+        self.address = "Address"
+        self.notes = "Notes"
+        self.payment_terms = "Payment Terms"
+        self.logo_url = ""
+        self.main_logo_stamp = None
+        # Settings the cached digest was computed from
+        self.digest_key = None
+        self.digest_value = ""
+        # path -> (mtime_ns, size) of the files last read
+        self.stamps = {}
+        self.last_check = 0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Re-read any file that changed since it was last read
+
+        Args:
+            force (bool): check now, regardless of check_interval
+
+        Returns:
+            bool: True if any setting changed
+        """
+        now = time.monotonic()
+        if not force and (
+            self.check_interval is None or now - self.last_check < self.check_interval
+        ):
+            return False
+        self.last_check = now
+        changed = False
+        for attr, filename, default in TEXT_FILES:
+            path = os.path.join(self.data_folder, filename)
+            stamp = file_stamp(path)
+            if stamp == self.stamps.get(path, False):
+                continue
+            self.stamps[path] = stamp
+            if stamp is None:
+                value = default
+            else:
+                with open(path, "r") as f:
+                    value = f.read()
+            if value != getattr(self, attr):
+                setattr(self, attr, value)
+                changed = True
+        stamp = file_stamp(self.main_logo_path)
+        if stamp != self.main_logo_stamp:
+            self.main_logo_stamp = stamp
+            changed = True
+        return changed
+
+    def has_main_logo(self):
+        """Return whether the compressed logo existed at the last check"""
+        return self.main_logo_stamp is not None
+
+    def digest(self):
+        """Return a hash of every setting, the theme and the compressed logo"""
+        key = tuple(getattr(self, attr) for attr, _, _ in TEXT_FILES)
+        key += (tuple(sorted(self.theme.items())), self.main_logo_stamp)
+        if self.digest_key != key:
+            h = hashlib.sha256(repr(key[:-1]).encode())
+            if self.has_main_logo():
+                with open(self.main_logo_path, "rb") as f:
+                    h.update(f.read())
+            self.digest_key = key
+            self.digest_value = h.hexdigest()
+        return self.digest_value
+
+
+def file_stamp(path):
+    """Return (mtime_ns, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_branding = None
+
+
+def get_branding():
+    """Return the branding config shared by this process"""
+    global _branding
+    if _branding is None:
+        _branding = BrandingConfig()
+    else:
+        _branding.refresh()
+    return _branding
@@ -0,0 +1,123 @@
+""" Drawing helpers that only emit FPDF state changes that are needed """
+
+
+def color_operator(r, g, b, gray, rgb):
+    """Return a colour operator formatted the way FPDF formats it"""
+    if (r == 0 and g == 0 and b == 0) or g == -1:
+        return "%.3f %s" % (r / 255.0, gray)
+    return "%.3f %.3f %.3f %s" % (r / 255.0, g / 255.0, b / 255.0, rgb)
+
+
+def set_draw_color(pdf, r, g=-1, b=-1):
+    """Set the stroking colour, skipping the operator if it is already set
+
+    FPDF writes the colour to the page on every call, even when it does not
+    change.
+    """
+    if color_operator(r, g, b, "G", "RG") != pdf.draw_color:
+        pdf.set_draw_color(r, g, b)
+
+
+def write_text(pdf, cells, w=85):
+    """Write left-aligned text cells as a single text object
+
+    Each cell is drawn where set_xy(x, y), set_font(style) and
+    cell(w, 0, txt) would draw it, using the current font family, size and
+    text colour. The colour is set once for the whole block, and the font
+    is only switched between cells whose style differs. The block is wrapped
+    in q/Q, so the document is left in the font of the first cell.
+
+    Args:
+        pdf (FPDF): document to draw on, using a core font
+        cells (list): (x, y, style, txt) tuples
+        w (float): width of each cell, which moves x after the last cell
+    """
+    if not cells:
+        return
+    family = pdf.font_family
+    size = pdf.font_size_pt
+    styles = {cell[2] for cell in cells}
+    for style in styles:
+        if family + style not in pdf.fonts:
+            # Register the font with the document
+            pdf.set_font(family, style, size)
+    style = cells[0][2]
+    pdf.set_font(family, style, size)
+    k = pdf.k
+    # Offset of the baseline below the top of a cell of height 0
+    baseline = 0.3 * pdf.font_size
+    parts = ["BT"]
+    if pdf.color_flag:
+        parts.append(pdf.text_color)
+    # Td moves relative to the start of the previous cell, so positions are
+    # rounded the way cell rounds them before taking the difference
+    last_x = last_y = 0.0
+    for x, y, cell_style, txt in cells:
+        if cell_style != style:
+            style = cell_style
+            parts.append("/F%d %.2f Tf" % (pdf.fonts[family + style]["i"], size))
+        text_x = round((x + pdf.c_margin) * k, 2)
+        text_y = round((pdf.h - (y + baseline)) * k, 2)
+        parts.append("%.2f %.2f Td (%s) Tj" % (text_x - last_x, text_y - last_y, pdf._escape(txt)))
+        last_x, last_y = text_x, text_y
+    parts.append("ET")
+    if len(styles) > 1 or pdf.color_flag:
+        # Keep the colour and font changes inside the block
+        parts.insert(0, "q")
+        parts.append("Q")
+    pdf._out(" ".join(parts))
+    pdf.x = x + w
+    pdf.y = y
+
+
+# Distance of the control points of a cubic Bezier quarter circle from its
+# ends, as a fraction of the radius
+KAPPA = 0.5523
+
+
+def fill_rounded_rect(pdf, x, y, w, h, r, color):
+    """Fill a rectangle with rounded corners
+
+    The fill colour is set inside q/Q, so the document's fill colour and
+    the colour of later cells are left as they were.
+
+    Args:
+        pdf (FPDF): document to draw on
+        x, y, w, h (float): position and size of the rectangle
+        r (float): radius of the corners
+        color (tuple): (r, g, b) fill colour
+    """
+    k = pdf.k
+
+    def point(px, py):
+        return "%.2f %.2f" % (px * k, (pdf.h - py) * k)
+
+    c = r * (1 - KAPPA)
+    right = x + w
+    bottom = y + h
+    parts = [
+        "q",
+        fill_operator(*color),
+        point(x + r, y), "m",
+        point(right - r, y), "l",
+        point(right - c, y), point(right, y + c), point(right, y + r), "c",
+        point(right, bottom - r), "l",
+        point(right, bottom - c), point(right - c, bottom), point(right - r, bottom), "c",
+        point(x + r, bottom), "l",
+        point(x + c, bottom), point(x, bottom - c), point(x, bottom - r), "c",
+        point(x, y + r), "l",
+        point(x, y + c), point(x + c, y), point(x + r, y), "c",
+        "f Q",
+    ]
+    pdf._out(" ".join(parts))
+
+
+def fill_operator(r, g, b):
+    """Return a fill colour operator
+
+    Components get four decimals rather than FPDF's three, so that every
+    8-bit colour survives the round trip, e.g. 58 is drawn as 58, not 57.
+    """
+    if r == g == b:
+        return "%.4f g" % (r / 255.0)
+    return "%.4f %.4f %.4f rg" % (r / 255.0, g / 255.0, b / 255.0)
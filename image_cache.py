@@ -0,0 +1,84 @@
+""" Process-wide cache of parsed PDF images """
+import hashlib
+import os
+import threading
+
+
+class ImageCache:
+    """Parsed image XObjects shared by every document rendered in a process
+
+    FPDF decodes and re-compresses a PNG every time a new document embeds it.
+    The cache keeps the parsed image data instead, keyed by the file's path
+    and modification time, and by the hash of its contents so that a touched
+    but unchanged file is not parsed again.
+    """
+
+    def __init__(self):
+        """Initialize cache"""
+        # path -> (mtime_ns, size, digest)
+        self.stats = {}
+        # digest -> (image info, minimum pdf version)
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Return the parsed image info and the pdf version it needs
+
+        Args:
+            path (str): path to a png or jpg image
+
+        Returns:
+            tuple: image info dict as built by FPDF, pdf version string
+        """
+        st = os.stat(path)
+        with self.lock:
+            cached = self.stats.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                return self.images[cached[2]]
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        with self.lock:
+            if digest not in self.images:
+                self.images[digest] = parse_image(path)
+            self.stats[path] = (st.st_mtime_ns, st.st_size, digest)
+            return self.images[digest]
+
+    def register(self, pdf, path):
+        """Add a cached image to a document so FPDF.image skips parsing it"""
+        if path in pdf.images:
+            return
+        info, version = self.get(path)
+        info = dict(info)
+        info["i"] = len(pdf.images) + 1
+        pdf.images[path] = info
+        if pdf.pdf_version < version:
+            pdf.pdf_version = version
+
+    def clear(self):
+        """Drop every cached image"""
+        with self.lock:
+            self.stats.clear()
+            self.images.clear()
+
+
+def parse_image(path):
+    """Parse an image file the way FPDF.image does
+
+    Returns:
+        tuple: image info dict, pdf version the image needs
+    """
+    from fpdf import FPDF
+
+    parser = FPDF()
+    ext = path.rsplit(".", 1)[-1].lower()
+    if ext in ("jpg", "jpeg"):
+        info = parser._parsejpg(path)
+    elif ext == "png":
+        info = parser._parsepng(path)
+    else:
+        info = parser._parsegif(path)
+    return info, parser.pdf_version
+
+
+# Cache shared by all PdfInvoice instances in this process
+image_cache = ImageCache()
@@ -0,0 +1,180 @@
+""" Streaming invoice ingestion from order-line exports """
+import contextlib
+import csv
+import datetime
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+from invoice import Invoice
+from product import Product
+
+# Columns every order line must provide
+FIELDS = ("customer", "invoice_date", "order_date", "product", "price", "quantity")
+
+
+def read_order_lines(path, fmt=None):
+    """Yield order lines from a CSV or JSONL file as dicts
+
+    Args:
+        path (str): path to the export
+        fmt (str): "csv" or "jsonl"; guessed from the extension if omitted
+    """
+    fmt = fmt or guess_format(path)
+    with open(path, "r", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        elif fmt == "jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unknown order line format: {fmt}")
+
+
+def guess_format(path):
+    """Return the export format implied by a file extension"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "csv"
+
+
+def group_key(line):
+    """Return the (customer, invoice date) an order line belongs to"""
+    try:
+        return (line["customer"], line["invoice_date"])
+    except KeyError as e:
+        raise ValueError(f"Order line is missing {e}: {line}") from None
+
+
+def iter_invoices(path, fmt=None, grouped=False, chunk_size=100000, fan_in=64):
+    """Yield an Invoice per customer and invoice date in an export
+
+    Only one invoice is held in memory at a time. Exports whose lines are
+    not already grouped by customer and invoice date are first sorted on
+    disk in runs of chunk_size lines, which are merged at most fan_in at a
+    time, so the number of open files stays bounded.
+
+    Args:
+        path (str): path to the export
+        fmt (str): "csv" or "jsonl"; guessed from the extension if omitted
+        grouped (bool): lines of each invoice are already consecutive
+        chunk_size (int): lines held in memory per sorted run
+        fan_in (int): most sorted runs open at once
+    """
+    lines = read_order_lines(path, fmt)
+    if grouped:
+        yield from group_lines(lines)
+        return
+    with tempfile.TemporaryDirectory(prefix="invoice_sort_") as folder:
+        runs = write_sorted_runs(lines, folder, chunk_size)
+        runs = merge_runs(runs, folder, fan_in)
+        with contextlib.ExitStack() as stack:
+            streams = [map(json.loads, stack.enter_context(open(run, "r"))) for run in runs]
+            # merge is stable, so lines keep their export order per invoice
+            yield from group_lines(heapq.merge(*streams, key=group_key))
+
+
+def write_sorted_runs(lines, folder, chunk_size):
+    """Write lines to files of chunk_size lines, each sorted by group key
+
+    Returns:
+        list: paths of the sorted runs
+    """
+    runs = []
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return runs
+        chunk.sort(key=group_key)
+        path = os.path.join(folder, f"run_{len(runs)}.jsonl")
+        with open(path, "w") as f:
+            for line in chunk:
+                f.write(json.dumps(line) + "\n")
+        runs.append(path)
+
+
+def merge_runs(runs, folder, fan_in):
+    """Merge sorted runs in passes until at most fan_in remain
+
+    Each pass merges consecutive groups of fan_in runs into one, so lines
+    with the same group key keep their export order.
+
+    Returns:
+        list: paths of the remaining sorted runs
+    """
+    if fan_in < 2:
+        raise ValueError(f"fan_in must be at least 2: {fan_in}")
+    merges = itertools.count()
+    while len(runs) > fan_in:
+        merged = []
+        for start in range(0, len(runs), fan_in):
+            group = runs[start:start + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            path = os.path.join(folder, f"merge_{next(merges)}.jsonl")
+            with contextlib.ExitStack() as stack, open(path, "w") as out:
+                files = [stack.enter_context(open(run, "r")) for run in group]
+                # Lines are copied as they are, parsing only for the key
+                out.writelines(heapq.merge(*files, key=lambda line: group_key(json.loads(line))))
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+    return runs
+
+
+def group_lines(lines):
+    """Yield an Invoice per run of consecutive lines with the same group key"""
+    for (customer, invoice_date), group in itertools.groupby(lines, key=group_key):
+        invoice = Invoice(customer, parse_date(invoice_date), [])
+        # Lines of the same product and price share one Product
+        products = {}
+        for line in group:
+            price = float(line["price"])
+            key = (line["product"], price)
+            if key not in products:
+                products[key] = Product(line["product"], price)
+            invoice.add_order(
+                customer,
+                parse_date(line["order_date"]),
+                parse_quantity(line["quantity"]),
+                products[key],
+            )
+        yield invoice
+
+
+def parse_invoice(payload):
+    """Return the Invoice described by a JSON object
+
+    The object holds the customer and invoice_date of the invoice, and an
+    orders list with the order_date, product, price and quantity of each
+    order line.
+    """
+    invoice_date = payload["invoice_date"]
+    lines = [
+        dict(order, customer=payload["customer"], invoice_date=invoice_date)
+        for order in payload["orders"]
+    ]
+    if not lines:
+        return Invoice(payload["customer"], parse_date(invoice_date), [])
+    return next(group_lines(lines))
+
+
+def parse_date(value):
+    """Parse a yyyy-mm-dd date"""
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+def parse_quantity(value):
+    """Parse a quantity, keeping whole numbers as ints"""
+    if isinstance(value, (int, float)):
+        return value
+    quantity = float(value)
+    return int(quantity) if quantity.is_integer() else quantity
@@ -1,26 +1,185 @@
 """ Invoice class """
+import bisect
+import hashlib
+import itertools
+from decimal import Decimal
 
 from order import Order
 
 
+class OrderIndex:
+    """Aggregates of the orders of an invoice, updated one order at a time
+
+    Holds the total and the subtotals per product and per day in integer
+    pence, the orders sorted by date, and a digest chained over every order
+    so that two invoices can be compared without walking their orders.
+    """
+
+    def __init__(self):
+        """Initialize an empty index"""
+        # Orders indexed, in the order they were added
+        self.orders = []
+        self.count = 0
+        self.total = 0
+        # product name -> [quantity in thousandths, cost in pence]
+        self.by_product = {}
+        # order date -> cost in pence
+        self.by_day = {}
+        # Orders sorted by date, in the order they were added for equal dates,
+        # and their date ordinals for bisecting
+        self.by_date = []
+        self.ordinals = []
+        self.digest = b""
+
+    def add(self, order):
+        """Index one more order"""
+        cost = round(order.cost * 100)
+        self.orders.append(order)
+        self.count += 1
+        self.total += cost
+        product = self.by_product.setdefault(order.product.name, [0, 0])
+        product[0] += round(order.quantity * 1000)
+        product[1] += cost
+        self.by_day[order.order_date] = self.by_day.get(order.order_date, 0) + cost
+        ordinal = order.order_date.toordinal()
+        if not self.ordinals or ordinal >= self.ordinals[-1]:
+            self.ordinals.append(ordinal)
+            self.by_date.append(order)
+        else:
+            i = bisect.bisect_right(self.ordinals, ordinal)
+            self.ordinals.insert(i, ordinal)
+            self.by_date.insert(i, order)
+        # Numbers are keyed by their exact value, so ints, floats and
+        # Decimals hash alike exactly when Order.__eq__ finds them equal
+        key = repr((
+            order.name,
+            order.product.name,
+            order.product.price.as_integer_ratio(),
+            order.quantity.as_integer_ratio(),
+            order.order_date.isoformat(),
+            order.cost.as_integer_ratio(),
+        ))
+        self.digest = hashlib.sha256(self.digest + key.encode()).digest()
+
+
 class Invoice:
-    """Invoice data class"""
+    """Invoice data class
+
+    Orders added with add_order, or appended to the orders list, are indexed
+    as they are first needed, so totals, subtotals, the orders by date and
+    comparisons do not walk every order again. A list changed in place in
+    any other way is indexed again; orders themselves are immutable.
+    """
 
     def __init__(self, name, date, orders):
-        """Initialize invoice"""
+        """Initialize invoice
+
+        Args:
+            name (str): customer name
+            date (datetime.date): invoice date
+            orders (iterable): Order objects; PdfInvoice also accepts a
+                one-shot iterator so very long invoices can be streamed
+        """
         self.name = name
         self.date = date
         self.orders = orders
 
+    @property
+    def orders(self):
+        """Return the orders of the invoice"""
+        return self._orders
+
+    @orders.setter
+    def orders(self, orders):
+        """Replace the orders, dropping their index"""
+        self._orders = orders
+        self.index = None
+
+    def __getstate__(self):
+        """Pickle the invoice without its index, which is rebuilt on use"""
+        return {"name": self.name, "date": self.date, "orders": self._orders}
+
+    def __setstate__(self, state):
+        """Restore an invoice, including pickles from before the index"""
+        self.name = state["name"]
+        self.date = state["date"]
+        self.orders = state.get("orders", state.get("_orders"))
+
+    def order_index(self):
+        """Return the index of the orders, or None for one-shot iterators"""
+        orders = self._orders
+        if iter(orders) is orders:
+            return None
+        count = len(orders)
+        if self.index is None or count < self.index.count or self.edited(orders):
+            self.index = OrderIndex()
+        if count > self.index.count:
+            if isinstance(orders, list):
+                new = orders[self.index.count:]
+            else:
+                new = itertools.islice(orders, self.index.count, None)
+            for order in new:
+                self.index.add(order)
+        return self.index
+
+    def edited(self, orders):
+        """Return whether a list of orders was changed other than by appending
+
+        The indexed orders are compared by identity first, so an unchanged
+        list is checked without calling Order.__eq__.
+        """
+        if not isinstance(orders, list):
+            # Tables only grow, and other sequences are not changed in place
+            return False
+        indexed = self.index.orders
+        if len(orders) == len(indexed):
+            return orders != indexed
+        return orders[:len(indexed)] != indexed
+
+    def total_pence(self):
+        """Return the total cost of every order in pence"""
+        return self.order_index().total
+
+    def total(self):
+        """Return the total cost of every order in pounds"""
+        return Decimal(self.total_pence()) / 100
+
+    def totals_by_product(self):
+        """Return the quantity in thousandths and cost in pence per product"""
+        return {name: tuple(sums) for name, sums in self.order_index().by_product.items()}
+
+    def totals_by_day(self):
+        """Return the total cost in pence per order date"""
+        return dict(self.order_index().by_day)
+
+    def orders_by_date(self):
+        """Return the orders sorted by order date"""
+        return list(self.order_index().by_date)
+
+    def orders_between(self, start, end):
+        """Return the orders dated from start to end inclusive, by date"""
+        index = self.order_index()
+        first = bisect.bisect_left(index.ordinals, start.toordinal())
+        last = bisect.bisect_right(index.ordinals, end.toordinal())
+        return index.by_date[first:last]
+
+    def digest(self):
+        """Return a hash of the customer, date and orders"""
+        key = repr((self.name, self.date.isoformat())).encode()
+        return hashlib.sha256(key + self.order_index().digest).hexdigest()
+
     def __str__(self):
         """Return a string representation of the invoice"""
+        return "".join(self.lines())
+
+    def lines(self):
+        """Yield the lines of the text report, e.g. to write to a file"""
         # print date in dd/mm/yyyy format
         date = self.date.strftime("%d/%m/%Y")
-        details = f"{self.name}\t{date}\n{'-' * 40}\n"
-        details += f" {'Product':<10} {'Quantity':<10} {'Cost':<10} {'Date':<15} \n"
+        yield f"{self.name}\t{date}\n{'-' * 40}\n"
+        yield f" {'Product':<10} {'Quantity':<10} {'Cost':<10} {'Date':<15} \n"
         for order in self.orders:
-            details += f"{order}\n"
-        return f"{details}"
+            yield f"{order}\n"
 
     def __eq__(self, other):
         """ Override the default Equals behavior
@@ -28,11 +187,17 @@ class Invoice:
         Args:
             other (Invoice): other invoice object
         """
-        return self.name == other.name and \
-            self.date == other.date and \
-            self.orders == other.orders
+        if self.name != other.name or self.date != other.date:
+            return False
+        index = self.order_index()
+        other_index = other.order_index()
+        if index is None or other_index is None:
+            return self.orders == other.orders
+        return index.count == other_index.count and index.digest == other_index.digest
 
     def add_order(self, name, order_date, quantity, product):
         """Add order to invoice"""
         order = Order(name, quantity, order_date, product)
         self.orders.append(order)
+        if self.index is not None and self.index.count == len(self.orders) - 1:
+            self.index.add(order)
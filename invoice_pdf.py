@@ -1,47 +1,90 @@
 #!/usr/bin/env python
 import datetime
+import hashlib
 import os
 import time
+import uuid
 
-import requests
-from fpdf import FPDF
-from PIL import Image
+from branding import get_branding
+from drawing import fill_rounded_rect, set_draw_color, write_text
+from image_cache import image_cache
+from logo import get_logo_manager
+from logo_asset import LOGO_DPI, LogoAsset, get_logo_asset
+from page_template import PageTemplate, restore_state, save_state
+from profiling import profiler, timed
 
 DEBUG = False
 
+# Bump whenever the layout changes, so cached renders are redone
+TEMPLATE_VERSION = 2
+
+# Table layout, in mm
+TABLE_TOP = 93.75
+FIRST_ROW = 107
+ROW_HEIGHT = 8
+# Table position on continuation pages
+CONTINUED_TABLE_TOP = 15
+# Space kept below the last row of a page for its subtotal
+PAGE_BOTTOM_MARGIN = 20
+# Space kept below the baseline of the last line of notes or terms, clear of
+# a printer's unprintable edge
+FOOTER_MARGIN = 5
+# Row the total is placed relative to when it moves to a page of its own
+CONTINUED_FOOTER_ROW = 5
+# Width and height the logo is placed at
+LOGO_SIZE = 30
+# Position and size of the balance due bar, and the x, width and height of
+# the table bar
+BALANCE_BAR = (112.5, 42, 95, 8.8)
+TABLE_BAR = (10.5, 195, 7.6)
+# Corner radius of both bars
+BAR_RADIUS = 1.0
+
+# Compiled page templates, keyed by PdfInvoice.template_key()
+_templates = {}
+
 
 class PdfInvoice:
     """Invoice PDF"""
 
-    def __init__(self, inv):
-        """Initialize invoice"""
+    def __init__(self, inv, compiled=False, branding=None):
+        """Initialize invoice
+
+        Args:
+            inv (Invoice): invoice to render
+            compiled (bool): draw invoices on a page template that holds the
+                static layout, built once per process
+            branding (BrandingConfig): business details; defaults to the
+                config shared by this process
+        """
         # Customer values
-        # If data folder doesn't exist, create it
-        if os.path.exists("data"):
-            # Read in address from file
-            with open("data/address.txt", "r") as f:
-                self.address = f.read()
-                # Read notes
-            with open("data/notes.txt", "r") as f:
-                self.notes = f.read()
-            # Read payment_terms
-            with open("data/payment_terms.txt", "r") as f:
-                self.payment_terms = f.read()
-        else:
-            self.address = "Address"
-            self.notes = "Notes"
-            self.payment_terms = "Payment Terms"
+        self.branding = branding or get_branding()
+        self.address = self.branding.address
+        self.notes = self.branding.notes
+        self.payment_terms = self.branding.payment_terms
         # Settings
         self.folder = "invoices"
-        self.logo_url = ""
+        self.logo_url = self.branding.logo_url
+        self.logo_dpi = LOGO_DPI
         self.width = 216.04
         self.height = 279.39
-        self.create_blank_pdf()
+        # Created by invoice_to_pdf
+        self.pdf = None
         self.invoice = inv
+        self.compiled = compiled
 
     def create_blank_pdf(self):
         """Create blank pdf"""
+        # Imported on first use, as it is slow to import
+        from fpdf import FPDF
+
         self.pdf = FPDF("P", "mm", (self.width, self.height))
+        # Pages are broken by add_orders, not by FPDF
+        self.pdf.set_auto_page_break(False)
+        self.new_page()
+
+    def new_page(self):
+        """Start a new page with the default caption style"""
         self.pdf.add_page()
         self.enable_grid(False)
         self.pdf.set_text_color(65, 65, 65)
@@ -60,118 +103,325 @@ class PdfInvoice:
                 self.draw_horizontal_line(0, i, 2000)
 
     def invoice_to_pdf(self):
-        """Generate invoice to pdf"""
-        
-        self.create_blank_pdf()
+        """Generate invoice to pdf
+
+        Returns:
+            str: path of the generated pdf
+        """
+        filename = self.filename()
+        self.draw()
+        with profiler.span("output"):
+            self.pdf.output(filename, "F")
+        dprint("[INFO] PDF generated")
+        return filename
+
+    def filename(self):
+        """Return the path invoice_to_pdf writes to"""
+        today = datetime.datetime.today().strftime("%d_%m_%Y")
+        return f"{self.folder}/{self.invoice.name}'s_invoice_{today}.pdf"
+
+    def content_hash(self):
+        """Return a hash of everything the rendered pdf depends on
+
+        Covers the invoice and its orders, the branding, the template
+        version and today's date, which is printed on the invoice. Returns
+        None if the orders are a one-shot iterator, as hashing would
+        consume them.
+        """
+        if self.invoice.order_index() is None:
+            return None
+        return hashlib.sha256(repr((
+            TEMPLATE_VERSION,
+            datetime.date.today().isoformat(),
+            self.branding.digest(),
+            self.invoice.digest(),
+        )).encode()).hexdigest()
+
+    def invoice_id(self):
+        """Return a short id derived from the customer, date and orders
+
+        Tells apart invoices of customers that share a name. Returns a
+        random id if the orders are a one-shot iterator.
+        """
+        if self.invoice.order_index() is None:
+            return uuid.uuid4().hex[:12]
+        return self.invoice.digest()[:12]
+
+    def render_to_bytes(self):
+        """Render the invoice and return the pdf as bytes"""
+        self.draw()
+        # FPDF builds the document as a latin-1 string
+        with profiler.span("output"):
+            return self.pdf.output(dest="S").encode("latin1")
+
+    def render_to(self, fileobj):
+        """Render the invoice into a binary file-like object
+
+        Returns:
+            int: number of bytes written
+        """
+        return fileobj.write(self.render_to_bytes())
+
+    def draw(self, pdf=None):
+        """Draw the invoice on a new page
+
+        Args:
+            pdf (FPDF): document to add the page to; a new document is
+                created if omitted
+        """
         name = self.invoice.name
         orders = self.invoice.orders
-        # Get todays date as dd/mm/yyyy string
-        today = datetime.datetime.today().strftime("%d_%m_%Y")
-        filename = f"{self.folder}/{name}'s_invoice_{today}.pdf"
-        # If invoice already exists
-        # if os.path.exists(filename):
-        #     return
-        # Calculate total income from items
-        total_income = sum(order.cost for order in orders)
+
+        if self.compiled:
+            template = self.get_template()
+            with profiler.span("template"):
+                if pdf is None:
+                    self.pdf = template.instantiate()
+                else:
+                    self.pdf = pdf
+                    template.add_page(self.pdf)
+            first_page = self.pdf.page
+            self.add_date(label=False)
+            self.add_bill_to(name, label=False)
+        else:
+            if pdf is None:
+                self.create_blank_pdf()
+            else:
+                self.pdf = pdf
+                self.new_page()
+            first_page = self.pdf.page
+            self.add_caption()
+            self.add_logo()
+            self.add_date()
+            self.add_from_address()
+            self.add_bill_to(name)
+            self.add_balance_due(label=True, value=False)
+            self.add_table()
+        # Orders may be a one-shot iterable, so the total is summed while
+        # the rows are drawn
+        row, total_income = self.add_orders(orders)
         total_income = f"{total_income:.2f}"
+        # Keep the total, notes and terms together on the last page
+        if row + self.footer_height() > self.height - FOOTER_MARGIN:
+            self.new_page()
+            row = CONTINUED_FOOTER_ROW
+        self.add_total(total_income, row)
+        if self.compiled:
+            with profiler.span("footer"):
+                template.add_footer(self.pdf, row)
+            dprint("[INFO] Invoice drawn on compiled template")
+        else:
+            self.add_notes_and_terms(row)
+        self.draw_on_page(first_page, self.add_balance_due, total_income, label=False)
+
+    def draw_on_page(self, page, draw, *args, **kwargs):
+        """Call a drawing method on an earlier page, then return to this one"""
+        state = save_state(self.pdf)
+        current = self.pdf.page
+        self.pdf.page = page
+        # Isolate the drawing from the rest of the page's content
+        self.pdf._out("q")
+        # The page's font and draw colour are unknown, so make them be emitted
+        self.pdf.font_family = ""
+        self.pdf.draw_color = ""
+        draw(*args, **kwargs)
+        self.pdf._out("Q")
+        self.pdf.page = current
+        restore_state(self.pdf, state)
+
+    def footer_height(self):
+        """Return the height from the last row to the baseline of the last
+        line of the notes or terms"""
+        heights = []
+        for top, text in ((30, self.notes), (80, self.payment_terms)):
+            # The header, then lines from 7.5 below it, 5 apart
+            lines = len(text.splitlines())
+            heights.append(top + (7.5 + 5 * (lines - 1) if lines else 0))
+        # Both are written in 10pt
+        return max(heights) + 0.3 * 10.0 / self.pdf.k
 
-        # NOTE: INVOICE CAPTION
+    def preload(self):
+        """Load the logo, images, fonts and page template ahead of rendering"""
+        if self.compiled:
+            self.get_template()
+        else:
+            # Drawing the static layout once warms every cache it touches
+            self.compile_template()
+
+    def template_key(self):
+        """Return the values the static page layout depends on"""
+        return (
+            self.width,
+            self.height,
+            self.address,
+            self.notes,
+            self.payment_terms,
+            self.branding.main_logo_stamp,
+            tuple(sorted(self.branding.theme.items())),
+        )
+
+    def get_template(self):
+        """Return the compiled page template, building it on first use"""
+        key = self.template_key()
+        if key not in _templates:
+            template = self.compile_template()
+            # Compiling may have created main_logo.png
+            key = self.template_key()
+            _templates[key] = template
+        return _templates[key]
+
+    @timed("compile_template")
+    def compile_template(self):
+        """Render the static layout once into a reusable page skeleton"""
+        self.create_blank_pdf()
+        self.add_caption()
+        self.add_logo()
+        self.add_date(value=False)
+        self.add_from_address()
+        self.add_bill_to(value=False)
+        self.add_balance_due(value=False)
+        self.add_table()
+        # Notes and terms follow the order rows, so capture their content
+        # stream separately and leave the skeleton state as it was
+        state = save_state(self.pdf)
+        start = len(self.pdf.pages[self.pdf.page])
+        # Force the footer to select its own font
+        self.pdf.font_family = ""
+        self.add_notes_and_terms(0)
+        footer = self.pdf.pages[self.pdf.page][start:]
+        self.pdf.pages[self.pdf.page] = self.pdf.pages[self.pdf.page][:start]
+        restore_state(self.pdf, state)
+        dprint("[INFO] Page template compiled")
+        return PageTemplate(self.pdf, footer)
+
+    @timed("caption")
+    def add_caption(self):
+        """Add the INVOICE caption"""
         self.pdf.set_xy(119, 14)
         self.pdf.cell(ln=0, h=0, align="R", w=85, txt="INVOICE", border=0)
         dprint("[INFO] Caption added")
-        # NOTE: LOGO
-        # If logo url has not been provided, download logo from url to images
-        if self.logo_url == "" and os.path.isfile("data/logo_url.txt"):
-            with open("data/logo_url.txt", "r") as f:
-                self.logo_url = f.read()
-            if self.logo_url:
-                r = requests.get(self.logo_url)
-                if r.status_code == 200:
-                    with open("images/logo.png", "wb") as f:
-                        f.write(r.content)
-                    dprint(f"[INFO] Logo downloaded from {self.logo_url}")
-                else:
-                    dprint(f"[ERROR] Failed to download logo from {self.logo_url}")
-            else:
-                dprint("[INFO] No logo url provided; Referring to local path")
-        # If images/main_logo.png does not exist, create it
-        if not os.path.isfile("images/main_logo.png"):
-            self.compress_image("images/logo.png")
-        self.load_image("main_logo.png", 12.8, 5, 30, 30)
+
+    @timed("logo")
+    def add_logo(self):
+        """Add the business logo"""
+        # If a logo url has been provided, refresh the local logo from it
+        if self.logo_url:
+            logo = get_logo_manager(self.logo_url, self.branding.logo_path)
+            with profiler.span("logo_download"):
+                updated = logo.ensure()
+            if updated:
+                dprint(f"[INFO] Logo downloaded from {self.logo_url}")
+            elif logo.error:
+                dprint(f"[ERROR] {logo.error}")
+        else:
+            dprint("[INFO] No logo url provided; Referring to local path")
+        # If images/main_logo.png is missing or was built from another logo,
+        # rebuild it
+        if self.logo_asset().ensure():
+            dprint("[INFO] Logo optimised")
+            self.branding.refresh(force=True)
+        self.load_image("main_logo.png", 12.8, 5, LOGO_SIZE, LOGO_SIZE)
         dprint("[INFO] Logo added")
-        # NOTE: DATE
+
+    @timed("date")
+    def add_date(self, label=True, value=True):
+        """Add today's date"""
         #  Get today's date in Month, Date, Year format
         today = datetime.date.today()
         # Reset font size
         self.pdf.set_font("helvetica", "", 10.0)
-        # Set font color to grey
-        self.pdf.set_xy(153, 37)
-        self.pdf.set_text_color(95, 95, 95)
-        self.pdf.cell(ln=0, h=0, align="L", w=0, txt="Date:", border=0)
-        self.pdf.set_text_color(0, 0, 0)
-        self.pdf.set_xy(177.5, 37)
-        self.pdf.cell(
-            ln=0, h=0, align="L", w=0, txt=f"{today.strftime('%B %d, %Y')}", border=0
-        )
-        dprint("[INFO] Date added")
-        # NOTE: FROM ADDRESS
-        # Reset font
-        self.pdf.set_xy(16.28, 42)
-        # for each new line in self.address
-        for _, line in enumerate(self.address.splitlines()):
-            self.pdf.set_font("helvetica", "", 10.0)
-            if _ == 0:
-                self.pdf.set_font("helvetica", "B", 10.0)
+        if label:
             # Set font color to grey
-            self.pdf.cell(ln=0, h=22.0, align="L", w=85, txt=line, border=0)
-            self.pdf.set_xy(16.28, self.pdf.get_y() + 4.3)
-        dprint("[INFO] From address added")
-        # NOTE: BILL TO
+            self.pdf.set_xy(153, 37)
+            self.pdf.set_text_color(95, 95, 95)
+            self.pdf.cell(ln=0, h=0, align="L", w=0, txt="Date:", border=0)
+        if value:
+            self.pdf.set_text_color(0, 0, 0)
+            self.pdf.set_xy(177.5, 37)
+            self.pdf.cell(
+                ln=0, h=0, align="L", w=0, txt=f"{today.strftime('%B %d, %Y')}", border=0
+            )
+        dprint("[INFO] Date added")
+
+    @timed("address")
+    def add_from_address(self):
+        """Add the business address"""
         # Reset font
+        self.pdf.set_text_color(0, 0, 0)
         self.pdf.set_font("helvetica", "", 10.0)
-        self.pdf.set_xy(16.28, 60.43)
-        self.pdf.cell(ln=0, h=22.0, align="L", w=85, txt="Bill To:", border=0)
-        # Reset font
-        self.pdf.set_font("helvetica", "B", 10.0)
-        self.pdf.set_xy(16.28, 66.175)
-        self.pdf.cell(ln=0, h=22.0, align="L", w=85, txt=f"{name}", border=0)
+        # First line in bold, each line 4.3mm below the last, centred in a
+        # 22mm high cell
+        cells = []
+        y = 42
+        for i, line in enumerate(self.address.splitlines()):
+            cells.append((16.28, y + 11.0, "B" if i == 0 else "", line))
+            y += 4.3
+        write_text(self.pdf, cells)
+        dprint("[INFO] From address added")
+
+    @timed("bill_to")
+    def add_bill_to(self, name="", label=True, value=True):
+        """Add the customer the invoice is billed to"""
+        if label:
+            # Reset font
+            self.pdf.set_font("helvetica", "", 10.0)
+            self.pdf.set_text_color(0, 0, 0)
+            self.pdf.set_xy(16.28, 60.43)
+            self.pdf.cell(ln=0, h=22.0, align="L", w=85, txt="Bill To:", border=0)
+        if value:
+            # Reset font
+            self.pdf.set_font("helvetica", "B", 10.0)
+            self.pdf.set_text_color(0, 0, 0)
+            self.pdf.set_xy(16.28, 66.175)
+            self.pdf.cell(ln=0, h=22.0, align="L", w=85, txt=f"{name}", border=0)
         dprint("[INFO] Bill to added")
-        rect_height = 7.4
-        # NOTE: ADDING RECTANGLE FOR BALANCE DUE
-        # Add rectangle and fill with color
-        self.load_image(image="balance_bar.png", x=112.5, y=42, w=95, h=8.8)
-        dprint("[INFO] Rectangle added")
-        # NOTE: BALANCE DUE
+
+    @timed("balance")
+    def add_balance_due(self, total_income="", label=True, value=True):
+        """Add the balance due box"""
         # Reset font
         self.pdf.set_font("helvetica", "B", 12.0)
-        self.pdf.set_xy(92, 46.4)
         self.pdf.set_text_color(65, 65, 65)
-        self.pdf.cell(
-            ln=0,
-            h=0,
-            align="C",
-            w=0,
-            txt="Balance Due:",
-            border=0,
-        )
-        self.pdf.set_xy(183, 46.4)
-        self.pdf.cell(
-            ln=0,
-            h=0,
-            align="C",
-            w=0,
-            txt=f"£{total_income}",
-            border=0,
-        )
+        if label:
+            # Add rectangle and fill with color
+            x, y, w, h = BALANCE_BAR
+            color = self.branding.theme["balance_bar"]
+            fill_rounded_rect(self.pdf, x, y, w, h, BAR_RADIUS, color)
+            dprint("[INFO] Rectangle added")
+            self.pdf.set_xy(92, 46.4)
+            self.pdf.cell(
+                ln=0,
+                h=0,
+                align="C",
+                w=0,
+                txt="Balance Due:",
+                border=0,
+            )
+        if value:
+            self.pdf.set_xy(183, 46.4)
+            self.pdf.cell(
+                ln=0,
+                h=0,
+                align="C",
+                w=0,
+                txt=f"£{total_income}",
+                border=0,
+            )
         dprint("[INFO] Balance due added")
-        # NOTE: ADDING TABLE
-        self.load_image(image="table_bar.png", x=10.5, y=93.75, w=195, h=7.6)
-        self.draw_vertical_line(124.5, 93.85, rect_height)
-        self.draw_vertical_line(151.5, 93.85, rect_height)
-        self.draw_vertical_line(179, 93.85, rect_height)
+
+    @timed("table")
+    def add_table(self, top=TABLE_TOP):
+        """Add the order table bar and header"""
+        rect_height = 7.4
+        x, w, h = TABLE_BAR
+        color = self.branding.theme["table_bar"]
+        fill_rounded_rect(self.pdf, x, top, w, h, BAR_RADIUS, color)
+        self.draw_vertical_line(124.5, top + 0.1, rect_height)
+        self.draw_vertical_line(151.5, top + 0.1, rect_height)
+        self.draw_vertical_line(179, top + 0.1, rect_height)
         dprint("[INFO] Table added")
         # NOTE: ADDING TABLE HEADER
-        text_height = 97.5
+        text_height = top + 3.75
         # Reset font
         self.pdf.set_font("helvetica", "", 10.0)
         self.pdf.set_xy(15.15, text_height)
@@ -184,39 +434,61 @@ class PdfInvoice:
         self.pdf.set_xy(187, text_height)
         self.pdf.cell(ln=0, h=0, align="L", w=85, txt="Amount", border=0)
         dprint("[INFO] Table header added")
-        # NOTE: ADDING orders
-        row = 107
+
+    @timed("items")
+    def add_orders(self, orders):
+        """Add a table row per order, continuing onto new pages as needed
+
+        Args:
+            orders (iterable): Order objects, consumed once
+
+        Returns:
+            tuple: y position of the row after the last order, total cost
+        """
+        row = FIRST_ROW
+        total = 0
+        page_total = 0
+        self.pdf.set_font("helvetica", "B", 10.0)
+        self.pdf.set_text_color(0, 0, 0)
         for order in orders:
-            quantity = order.quantity
-            # If quantity has 2dp
-            if quantity % 1 == 0:
-                quantity_str = f"{quantity:.0f}"
-            # if quantity has 1dp
-            elif quantity % 1 == 0.5:
-                quantity_str = f"{quantity:.1f}"
-            # if quantity has 2dp
-            elif quantity % 1 == 0.25:
-                quantity_str = f"{quantity:.2f}"
-            # Reset font
-            self.pdf.set_font("helvetica", "B", 10.0)
-            self.pdf.set_text_color(0, 0, 0)
-            # Item
-            self.pdf.set_xy(15.1, row)
-            self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"{order.product.name} ({order.get_date()})", border=0)
-            # reset font
-            self.pdf.set_font("helvetica", "", 10.0)
-            # Quantity
-            self.pdf.set_xy(129, row)
-            self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"{quantity_str}", border=0)
-            # Rate
-            self.pdf.set_xy(165, row)
-            self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"£{order.product.price:.2f}", border=0)
-            # Amount
-            self.pdf.set_xy(187, row)
-            self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"£{order.cost:.2f}", border=0)
-            row += 8
+            if row + ROW_HEIGHT > self.height - PAGE_BOTTOM_MARGIN:
+                self.add_page_subtotal(f"{page_total:.2f}", row)
+                self.new_page()
+                self.add_table(CONTINUED_TABLE_TOP)
+                row = CONTINUED_TABLE_TOP + FIRST_ROW - TABLE_TOP
+                page_total = 0
+                self.pdf.set_font("helvetica", "B", 10.0)
+                self.pdf.set_text_color(0, 0, 0)
+            # Up to 2dp, without trailing zeros, e.g. 2, 0.5 or 1.25
+            quantity_str = f"{order.quantity:.2f}".rstrip("0").rstrip(".")
+            # Item in bold, then quantity, rate and amount
+            write_text(self.pdf, (
+                (15.1, row, "B", f"{order.product.name} ({order.get_date()})"),
+                (129, row, "", f"{quantity_str}"),
+                (165, row, "", f"£{order.product.price:.2f}"),
+                (187, row, "", f"£{order.cost:.2f}"),
+            ))
+            total += order.cost
+            page_total += order.cost
+            row += ROW_HEIGHT
         dprint("[INFO] Items added")
-        # NOTE: ADDING TOTAL
+        return row, total
+
+    @timed("subtotal")
+    def add_page_subtotal(self, subtotal, row):
+        """Add the subtotal of the rows on a page that continues"""
+        self.pdf.set_font("helvetica", "", 10.0)
+        self.pdf.set_xy(153, row + 2)
+        self.pdf.set_text_color(145, 145, 145)
+        self.pdf.cell(ln=0, h=0, align="L", w=85, txt="Subtotal:", border=0)
+        self.pdf.set_xy(187, row + 2)
+        self.pdf.set_text_color(0, 0, 0)
+        self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"£{subtotal}", border=0)
+        dprint("[INFO] Page subtotal added")
+
+    @timed("total")
+    def add_total(self, total_income, row):
+        """Add the invoice total below the order rows"""
         self.pdf.set_font("helvetica", "", 10.0)
         self.pdf.set_xy(153, row + 15)
         # set text color light gray
@@ -227,14 +499,17 @@ class PdfInvoice:
         self.pdf.set_text_color(0, 0, 0)
         self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"£{total_income}", border=0)
         dprint("[INFO] Total added")
+
+    def add_notes_and_terms(self, row):
+        """Add the notes and payment terms below the order rows"""
         # NOTE: FINAL NOTES in bottom left corner
-        self.write_sentences("Notes", self.notes, row)
+        with profiler.span("notes"):
+            self.write_sentences("Notes", self.notes, row)
         dprint("[INFO] Notes added")
         row += 50
-        self.write_sentences("Terms", self.payment_terms, row)
+        with profiler.span("terms"):
+            self.write_sentences("Terms", self.payment_terms, row)
         dprint("[INFO] Terms added")
-        self.pdf.output(filename, "F")
-        dprint("[INFO] PDF generated")
 
     def write_sentences(self, header, notes, row):
         """Write sentences to pdf"""
@@ -243,21 +518,21 @@ class PdfInvoice:
         # Set text color gray
         self.pdf.set_text_color(145, 145, 145)
         self.pdf.cell(ln=0, h=0, align="L", w=85, txt=f"{header}:", border=0)
-        self.pdf.set_xy(16, self.pdf.get_y() + 7.5)
+        y = self.pdf.get_y() + 7.5
 
         self.pdf.set_text_color(55, 55, 55)
-        self.pdf.set_font("helvetica", "", 10.0)
-        for _, line in enumerate(notes.splitlines()):
-            # Set font color to grey
-            self.pdf.cell(ln=0, h=0, align="L", w=85, txt=line, border=0)
-            self.pdf.set_xy(16, self.pdf.get_y() + 5)
+        cells = []
+        for line in notes.splitlines():
+            cells.append((16, y, "", line))
+            y += 5
+        write_text(self.pdf, cells)
 
     def draw_vertical_line(self, x, y, h, color=False):
         """Draw vertical line"""
         if color:
-            self.pdf.set_draw_color(255, 0, 0)
+            set_draw_color(self.pdf, 255, 0, 0)
         else:
-            self.pdf.set_draw_color(95, 95, 95)
+            set_draw_color(self.pdf, 95, 95, 95)
         # Vertical line
         x1, y1 = x, y
         x2, y2 = x, y1 + h
@@ -267,24 +542,88 @@ class PdfInvoice:
     def draw_horizontal_line(self, x, y, w, color=False):
         """Draw horizontal line"""
         if color:
-            self.pdf.set_draw_color(255, 0, 0)
+            set_draw_color(self.pdf, 255, 0, 0)
         else:
-            self.pdf.set_draw_color(175, 175, 175)
+            set_draw_color(self.pdf, 175, 175, 175)
         # Vertical line
         x1, y1 = x, y
         x2, y2 = x1 + w, y
         # X1, Y1, X2, Y2
         self.pdf.line(x1, y1, x2, y2)
 
+    @timed("image_load")
     def load_image(self, image, x, y, w, h):
         """Load image from file"""
-        self.pdf.image(f"images/{image}", x, y, w, h)
+        path = os.path.join(self.branding.images_folder, image)
+        # Parsed once per process, then shared by every document
+        image_cache.register(self.pdf, path)
+        self.pdf.image(path, x, y, w, h)
+
+    def logo_asset(self):
+        """Return the optimised logo shared by this process"""
+        return get_logo_asset(
+            self.branding.logo_path,
+            self.branding.main_logo_path,
+            (LOGO_SIZE, LOGO_SIZE),
+            self.logo_dpi,
+        )
 
     def compress_image(self, image_path):
-        """reduce dimensions of image"""
-        img = Image.open(image_path)
-        img.thumbnail((600, 600), Image.ANTIALIAS)
-        img.save("images/main_logo.png", "PNG")
+        """Write an optimised copy of an image to main_logo.png"""
+        LogoAsset(
+            image_path, self.branding.main_logo_path, (LOGO_SIZE, LOGO_SIZE), self.logo_dpi
+        ).build()
+
+
+class InvoiceDocument:
+    """Several invoices rendered as the pages of one PDF
+
+    Every page refers to the same image and font objects, so the logo and
+    fonts are stored once per document instead of once per invoice.
+    """
+
+    def __init__(self, compiled=False, branding=None):
+        """Initialize document
+
+        Args:
+            compiled (bool): draw invoices on the compiled page template
+            branding (BrandingConfig): business details; defaults to the
+                config shared by this process
+        """
+        self.compiled = compiled
+        self.branding = branding
+        self.pdf = None
+        self.count = 0
+
+    def add(self, invoice):
+        """Add an invoice as the next page"""
+        generate = PdfInvoice(invoice, compiled=self.compiled, branding=self.branding)
+        generate.draw(self.pdf)
+        self.pdf = generate.pdf
+        self.count += 1
+
+    def output(self, filename):
+        """Write the document to a file"""
+        self.pdf.output(filename, "F")
+        dprint(f"[INFO] PDF generated with {self.count} invoices")
+        return filename
+
+
+def iter_documents(invoices, size, compiled=False, branding=None):
+    """Yield documents holding up to size invoices each
+
+    Args:
+        invoices (iterable): Invoice objects, consumed lazily
+        size (int): invoices per document
+    """
+    document = InvoiceDocument(compiled, branding)
+    for invoice in invoices:
+        document.add(invoice)
+        if document.count == size:
+            yield document
+            document = InvoiceDocument(compiled, branding)
+    if document.count:
+        yield document
 
 
 def dprint(msg):
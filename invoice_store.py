@@ -0,0 +1,170 @@
+""" Random-access binary invoice store """
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from array import array
+
+MAGIC = b"INVSTOR1"
+# Each record is its length followed by the pickled invoice
+RECORD_HEADER = struct.Struct("<I")
+# The file ends with the offset of the index, the record count and MAGIC
+FOOTER = struct.Struct("<QQ8s")
+
+
+class InvoiceStoreWriter:
+    """Writes invoices to a store file
+
+    Records are length-prefixed pickles written one after the other, followed
+    by an index of record offsets. The file is built under a temporary name
+    and only renamed into place when the writer is closed.
+    """
+
+    def __init__(self, path):
+        """Initialize writer
+
+        Args:
+            path (str): path of the store to create or replace
+        """
+        self.path = path
+        folder = os.path.dirname(path) or "."
+        fd, self.tmp = tempfile.mkstemp(dir=folder, prefix=".tmp_")
+        self.file = os.fdopen(fd, "wb")
+        self.file.write(MAGIC)
+        self.offsets = array("Q")
+
+    def write(self, invoice):
+        """Append an invoice"""
+        data = pickle.dumps(invoice, pickle.HIGHEST_PROTOCOL)
+        self.offsets.append(self.file.tell())
+        self.file.write(RECORD_HEADER.pack(len(data)))
+        self.file.write(data)
+
+    def close(self):
+        """Write the index and move the store into place"""
+        index_offset = self.file.tell()
+        self.file.write(self.offsets.tobytes())
+        self.file.write(FOOTER.pack(index_offset, len(self.offsets), MAGIC))
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        """Discard the partially written store"""
+        self.file.close()
+        os.unlink(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_invoices(path, invoices):
+    """Write invoices to a new store
+
+    Returns:
+        int: number of invoices written
+    """
+    with InvoiceStoreWriter(path) as writer:
+        for invoice in invoices:
+            writer.write(invoice)
+    return len(writer.offsets)
+
+
+class InvoiceStore:
+    """Memory-mapped, read-only view of a store file
+
+    Only the offset index is read up front; each invoice is unpickled when
+    it is accessed.
+    """
+
+    def __init__(self, path):
+        """Open a store
+
+        Args:
+            path (str): path of the store
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < len(MAGIC) + FOOTER.size or self.mm[: len(MAGIC)] != MAGIC:
+            self.mm.close()
+            raise ValueError(f"Not an invoice store: {path}")
+        index_offset, count, magic = FOOTER.unpack_from(self.mm, len(self.mm) - FOOTER.size)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"Invoice store is incomplete: {path}")
+        self.offsets = array("Q")
+        self.offsets.frombytes(self.mm[index_offset: index_offset + 8 * count])
+
+    def __len__(self):
+        """Return the number of invoices"""
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """Return invoice i, or a list of invoices for a slice"""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("invoice index out of range")
+        offset = self.offsets[i]
+        (size,) = RECORD_HEADER.unpack_from(self.mm, offset)
+        start = offset + RECORD_HEADER.size
+        return pickle.loads(self.mm[start: start + size])
+
+    def __iter__(self):
+        """Yield every invoice in order"""
+        for i in range(len(self)):
+            yield self[i]
+
+    def shards(self, count):
+        """Split the store into count contiguous shards of near equal size"""
+        size, extra = divmod(len(self), count)
+        shards = []
+        start = 0
+        for n in range(count):
+            stop = start + size + (1 if n < extra else 0)
+            shards.append(StoreShard(self.path, start, stop))
+            start = stop
+        return shards
+
+    def close(self):
+        """Unmap the store"""
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StoreShard:
+    """Range of invoices in a store that can be handed to another process
+
+    Shards only hold the path and range, so they pickle cheaply; the store
+    is opened when the shard is iterated.
+    """
+
+    def __init__(self, path, start, stop):
+        """Initialize shard"""
+        self.path = path
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        """Return the number of invoices in the shard"""
+        return self.stop - self.start
+
+    def __iter__(self):
+        """Yield the invoices of the shard"""
+        with InvoiceStore(self.path) as store:
+            for i in range(self.start, self.stop):
+                yield store[i]
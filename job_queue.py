@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+""" Crash-resumable render queue
+
+Invoices are queued in a SQLite database. Workers lease a few jobs at a
+time, render them and acknowledge each one, so a run that is killed can be
+resumed without rendering finished invoices again.
+
+    python job_queue.py enqueue month.db orders.csv
+    python job_queue.py run month.db --processes 4
+    python job_queue.py resume month.db --processes 4
+    python job_queue.py status month.db
+"""
+import argparse
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+import time
+from multiprocessing import Process
+
+import ingest
+import orders
+from invoice_store import InvoiceStore
+from output_sink import FolderSink
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    invoice BLOB NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires REAL,
+    filename TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available_at);
+"""
+
+# Job states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Durable queue of invoices to render, stored in a SQLite database
+
+    A leased job belongs to its worker until the lease expires; if the
+    worker dies, another one picks the job up after that. A failed render is
+    retried after a delay that doubles with every attempt, and is marked
+    failed once it has used up max_attempts.
+
+    Workers on several hosts can share a queue on a shared filesystem, as
+    long as it supports the file locks SQLite relies on.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=5, backoff=2.0):
+        """Open or create a queue
+
+        Args:
+            path (str): path of the database
+            lease_seconds (float): time a worker has to finish a leased job
+            max_attempts (int): renders tried before a job is marked failed
+            backoff (float): seconds before the first retry
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        # Autocommit mode; transactions are opened explicitly
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def add(self, invoices, batch=1000):
+        """Queue invoices for rendering
+
+        Returns:
+            int: number of invoices queued
+        """
+        count = 0
+        rows = []
+        for invoice in invoices:
+            rows.append((invoice.name, pickle.dumps(invoice, pickle.HIGHEST_PROTOCOL)))
+            if len(rows) == batch:
+                count += self.insert(rows)
+                rows = []
+        return count + self.insert(rows)
+
+    def insert(self, rows):
+        """Insert (name, pickled invoice) rows in one transaction"""
+        with self.transaction():
+            self.db.executemany("INSERT INTO jobs (name, invoice) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def lease(self, owner, count=1):
+        """Lease up to count jobs that are due
+
+        Expired leases are released first, as a failed attempt, so a job
+        that keeps killing its worker ends up failed instead of being
+        retried forever.
+
+        Returns:
+            list: (job id, invoice) pairs
+        """
+        now = time.time()
+        with self.transaction():
+            expired = self.db.execute(
+                "SELECT id, attempts FROM jobs WHERE state = ? AND lease_expires < ?",
+                (LEASED, now),
+            ).fetchall()
+            self.release(expired, "Lease expired before the job was finished", now)
+            rows = self.db.execute(
+                "SELECT id, invoice FROM jobs WHERE state = ? AND available_at <= ?"
+                " ORDER BY id LIMIT ?",
+                (PENDING, now, count),
+            ).fetchall()
+            self.db.executemany(
+                "UPDATE jobs SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                [(LEASED, owner, now + self.lease_seconds, job_id) for job_id, _ in rows],
+            )
+        return [(job_id, pickle.loads(invoice)) for job_id, invoice in rows]
+
+    def ack(self, job_id, owner, filename):
+        """Mark a leased job as rendered
+
+        Returns:
+            bool: False if the lease had been lost to another worker
+        """
+        with self.transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = ?, filename = ?, error = NULL, owner = NULL"
+                " WHERE id = ? AND state = ? AND owner = ?",
+                (DONE, filename, job_id, LEASED, owner),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, owner, error):
+        """Schedule a retry of a leased job, or mark it failed
+
+        Returns:
+            bool: False if the lease had been lost to another worker
+        """
+        with self.transaction():
+            row = self.db.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND state = ? AND owner = ?",
+                (job_id, LEASED, owner),
+            ).fetchone()
+            if row is None:
+                return False
+            self.release([(job_id, row[0])], error, time.time())
+        return True
+
+    def recover(self, host=None):
+        """Release the leases of workers on this host that are no longer running
+
+        Their jobs would otherwise wait for the lease to expire.
+
+        Returns:
+            int: number of jobs released
+        """
+        host = host or socket.gethostname()
+        with self.transaction():
+            rows = self.db.execute(
+                "SELECT id, owner, attempts FROM jobs WHERE state = ? AND owner LIKE ?",
+                (LEASED, f"{host}:%"),
+            ).fetchall()
+            stale = [
+                (job_id, attempts) for job_id, owner, attempts in rows if not pid_running(owner)
+            ]
+            self.release(stale, "Worker stopped before the job was finished", time.time())
+        return len(stale)
+
+    def release(self, jobs, error, now):
+        """Schedule a retry of leased jobs after a failed attempt, or mark
+        those that used up max_attempts failed
+
+        Must be called within a transaction.
+
+        Args:
+            jobs (list): (job id, attempts) pairs
+            error (str): reason the attempt failed
+            now (float): time the attempt failed
+        """
+        updates = []
+        for job_id, attempts in jobs:
+            if attempts >= self.max_attempts:
+                state, available_at = FAILED, 0
+            else:
+                state, available_at = PENDING, now + self.backoff * 2 ** (attempts - 1)
+            updates.append((state, available_at, error, job_id))
+        self.db.executemany(
+            "UPDATE jobs SET state = ?, available_at = ?, error = ?, owner = NULL WHERE id = ?",
+            updates,
+        )
+
+    def retry_failed(self):
+        """Queue every failed job again with a fresh set of attempts
+
+        Returns:
+            int: number of jobs queued
+        """
+        with self.transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, available_at = 0 WHERE state = ?",
+                (PENDING, FAILED),
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Return the number of jobs in each state"""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for state, count in self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def next_available(self):
+        """Return when the next pending job or lease becomes due, or None
+        if no job is left to do"""
+        row = self.db.execute(
+            "SELECT MIN(CASE state WHEN ? THEN available_at ELSE lease_expires END)"
+            " FROM jobs WHERE state IN (?, ?)",
+            (PENDING, PENDING, LEASED),
+        ).fetchone()
+        return row[0]
+
+    def failures(self):
+        """Return (job id, name, error) of every failed job"""
+        return self.db.execute(
+            "SELECT id, name, error FROM jobs WHERE state = ? ORDER BY id", (FAILED,)
+        ).fetchall()
+
+    def transaction(self):
+        """Return a context manager holding the write lock for a transaction"""
+        return Transaction(self.db)
+
+    def close(self):
+        """Close the database"""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Transaction:
+    """Runs a block in an immediate transaction, rolled back on error"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        # Take the write lock up front, so two workers never lease the same job
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def worker_name():
+    """Return the lease owner name of this process"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def pid_running(owner):
+    """Return whether the process of a lease owner on this host is running"""
+    try:
+        pid = int(owner.rsplit(":", 1)[1])
+        os.kill(pid, 0)
+    except (ValueError, IndexError, ProcessLookupError):
+        return False
+    except PermissionError:
+        # Running, under another user
+        return True
+    try:
+        # Killed workers linger as zombies until they are reaped
+        with open(f"/proc/{pid}/stat", "r") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return True
+
+
+def work(path, compiled=True, folder="invoices", batch=4, poll=1.0, queue_options=None,
+         logo_checked=False, sink=None):
+    """Render queued invoices until none are left
+
+    Args:
+        path (str): path of the queue database
+        compiled (bool): render on the compiled page template
+        folder (str): folder the pdf files are written to
+        batch (int): jobs leased at a time
+        poll (float): longest wait for retries or other workers' leases
+        queue_options (dict): keyword arguments for JobQueue
+        logo_checked (bool): the logo was already fetched for this run
+        sink (FolderSink): where the pdfs are written; defaults to one file
+            per invoice in folder
+
+    Returns:
+        int: number of invoices rendered by this worker
+    """
+    sink = sink or FolderSink(folder)
+    if not sink.parallel:
+        raise ValueError("Queue workers need a sink every worker can write to")
+    os.makedirs(folder, exist_ok=True)
+    orders.init_worker({
+        "compiled": compiled,
+        "folder": folder,
+        "logo_checked": logo_checked,
+        "sink": sink,
+    })
+    owner = worker_name()
+    rendered = 0
+    with JobQueue(path, **(queue_options or {})) as queue:
+        while True:
+            jobs = queue.lease(owner, batch)
+            if not jobs:
+                due = queue.next_available()
+                if due is None:
+                    sink.close()
+                    return rendered
+                time.sleep(min(max(due - time.time(), 0.01), poll))
+                continue
+            for item in jobs:
+                result = orders.render_invoice(item)
+                if result.ok:
+                    rendered += queue.ack(result.index, owner, result.filename)
+                else:
+                    queue.fail(result.index, owner, result.error)
+
+
+def run_workers(path, processes=1, **kwargs):
+    """Render the queue with several worker processes
+
+    Returns:
+        dict: number of jobs in each state once the workers finish
+    """
+    orders.prepare_batch(kwargs.get("compiled", True))
+    kwargs["logo_checked"] = True
+    if processes == 1:
+        work(path, **kwargs)
+    else:
+        workers = [Process(target=work, args=(path,), kwargs=kwargs) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    with JobQueue(path) as queue:
+        return queue.counts()
+
+
+def read_invoices(path):
+    """Yield the invoices of an invoice store or an order line export"""
+    if path.endswith(".store"):
+        with InvoiceStore(path) as store:
+            yield from store
+    else:
+        yield from ingest.iter_invoices(path)
+
+
+def main(argv=None):
+    """Manage a render queue from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="queue invoices for rendering")
+    enqueue.add_argument("queue", help="queue database")
+    enqueue.add_argument("invoices", help="invoice store (.store) or order line export")
+    for name, help in (
+        ("run", "render queued invoices"),
+        ("resume", "release this host's dead workers' leases, then render"),
+    ):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("queue", help="queue database")
+        command.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes")
+        command.add_argument("--folder", default="invoices", help="output folder")
+        command.add_argument("--classic", action="store_true", help="render without the page template")
+        command.add_argument("--retry-failed", action="store_true", help="also retry failed jobs")
+        command.add_argument("--shards", type=int, default=0, help="levels of output subfolders")
+        command.add_argument("--unique", action="store_true", help="add an invoice id to file names")
+        command.add_argument("--sync-batch", type=int, default=0, help="files written between fsyncs")
+    status = commands.add_parser("status", help="count jobs in each state")
+    status.add_argument("queue", help="queue database")
+    args = parser.parse_args(argv)
+
+    if args.command == "enqueue":
+        with JobQueue(args.queue) as queue:
+            print(f"{queue.add(read_invoices(args.invoices))} invoices queued")
+        return 0
+    if args.command in ("run", "resume"):
+        with JobQueue(args.queue) as queue:
+            if args.command == "resume":
+                print(f"{queue.recover()} leases released")
+            if args.retry_failed:
+                print(f"{queue.retry_failed()} failed jobs queued again")
+        sink = FolderSink(args.folder, args.shards, args.unique, args.sync_batch)
+        run_workers(
+            args.queue, args.processes, compiled=not args.classic, folder=args.folder, sink=sink
+        )
+    with JobQueue(args.queue) as queue:
+        counts = queue.counts()
+        for job_id, name, error in queue.failures():
+            print(f"job {job_id} ({name}) failed:\n{error}")
+    print(" ".join(f"{state} {count}" for state, count in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
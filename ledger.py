@@ -0,0 +1,164 @@
+""" Columnar ledger of the order lines of a batch of invoices """
+import csv
+import datetime
+from array import array
+
+from order_table import OrderTable, to_hundredths, to_thousandths
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Columns of the line report
+LINE_FIELDS = ("invoice", "customer", "date", "product", "quantity", "cost")
+
+
+class Ledger:
+    """Order lines of many invoices stored as typed columns
+
+    Customers and products are stored once and referenced by id, money is
+    kept in integer pence and quantities in thousandths, as in an OrderTable.
+    Grouped totals are computed with one bincount per column when NumPy is
+    installed.
+    """
+
+    def __init__(self):
+        """Initialize ledger"""
+        self.customers = []
+        self.customer_index = {}
+        self.products = []
+        self.product_index = {}
+        self.invoice_count = 0
+        # One entry per order line
+        self.invoice_column = array("I")
+        self.customer_column = array("I")
+        self.product_column = array("I")
+        self.dates = array("I")
+        self.quantities = array("q")
+        self.costs = array("q")
+
+    @classmethod
+    def from_invoices(cls, invoices):
+        """Build a ledger from an iterable of invoices"""
+        ledger = cls()
+        for invoice in invoices:
+            ledger.append(invoice)
+        return ledger
+
+    def intern(self, values, index, value):
+        """Return the id of value, adding it to values if it is new"""
+        if value not in index:
+            index[value] = len(values)
+            values.append(value)
+        return index[value]
+
+    def append(self, invoice):
+        """Add the order lines of an invoice"""
+        invoice_id = self.invoice_count
+        self.invoice_count += 1
+        customer_id = self.intern(self.customers, self.customer_index, invoice.name)
+        orders = invoice.orders
+        if isinstance(orders, OrderTable):
+            # Copy the table's columns without building Order objects
+            ids = [self.intern(self.products, self.product_index, product.name) for product in orders.products]
+            count = len(orders)
+            self.invoice_column.extend([invoice_id] * count)
+            self.customer_column.extend([customer_id] * count)
+            self.product_column.extend(ids[product_id] for product_id in orders.product_column)
+            self.dates.extend(orders.dates)
+            self.quantities.extend(orders.quantities)
+            self.costs.extend(int(cost) for cost in orders.line_costs())
+            return
+        for order in orders:
+            self.invoice_column.append(invoice_id)
+            self.customer_column.append(customer_id)
+            self.product_column.append(self.intern(self.products, self.product_index, order.product.name))
+            self.dates.append(order.order_date.toordinal())
+            self.quantities.append(to_thousandths(order.quantity))
+            self.costs.append(to_hundredths(order.cost))
+
+    def __len__(self):
+        """Return the number of order lines"""
+        return len(self.costs)
+
+    def total(self):
+        """Return the total cost of every line in pence"""
+        return sum(self.costs)
+
+    def group_sums(self, keys, values, size):
+        """Return the sum of values for each key in range(size)"""
+        if np is not None and len(keys):
+            sums = np.bincount(
+                np.frombuffer(keys, dtype=np.uint32),
+                weights=np.frombuffer(values, dtype=np.int64),
+                minlength=size,
+            )
+            return [int(round(value)) for value in sums]
+        sums = [0] * size
+        for key, value in zip(keys, values):
+            sums[key] += value
+        return sums
+
+    def totals_by_customer(self):
+        """Return the total cost in pence per customer"""
+        sums = self.group_sums(self.customer_column, self.costs, len(self.customers))
+        return dict(zip(self.customers, sums))
+
+    def totals_by_product(self):
+        """Return the quantity in thousandths and cost in pence per product"""
+        size = len(self.products)
+        quantities = self.group_sums(self.product_column, self.quantities, size)
+        costs = self.group_sums(self.product_column, self.costs, size)
+        return {name: (quantity, cost) for name, quantity, cost in zip(self.products, quantities, costs)}
+
+    def totals_by_day(self):
+        """Return the total cost in pence per order date"""
+        if not len(self):
+            return {}
+        first = min(self.dates)
+        days = array("I", (ordinal - first for ordinal in self.dates))
+        sums = self.group_sums(days, self.costs, max(days) + 1)
+        return {
+            datetime.date.fromordinal(first + day): total
+            for day, total in enumerate(sums)
+            if total
+        }
+
+    def write_lines(self, fileobj):
+        """Write every order line as CSV"""
+        writer = csv.writer(fileobj)
+        writer.writerow(LINE_FIELDS)
+        for i in range(len(self)):
+            writer.writerow((
+                self.invoice_column[i],
+                self.customers[self.customer_column[i]],
+                datetime.date.fromordinal(self.dates[i]).isoformat(),
+                self.products[self.product_column[i]],
+                format_thousandths(self.quantities[i]),
+                format_hundredths(self.costs[i]),
+            ))
+
+    def write_summary(self, fileobj):
+        """Write totals per customer, product and day as CSV"""
+        writer = csv.writer(fileobj)
+        writer.writerow(("group", "key", "quantity", "cost"))
+        for customer, cost in sorted(self.totals_by_customer().items()):
+            writer.writerow(("customer", customer, "", format_hundredths(cost)))
+        for product, (quantity, cost) in sorted(self.totals_by_product().items()):
+            writer.writerow(("product", product, format_thousandths(quantity), format_hundredths(cost)))
+        for day, cost in sorted(self.totals_by_day().items()):
+            writer.writerow(("day", day.isoformat(), "", format_hundredths(cost)))
+        writer.writerow(("total", "", "", format_hundredths(self.total())))
+
+
+def format_hundredths(value):
+    """Format an integer number of hundredths with two decimal places"""
+    sign = "-" if value < 0 else ""
+    return f"{sign}{abs(value) // 100}.{abs(value) % 100:02d}"
+
+
+def format_thousandths(value):
+    """Format an integer number of thousandths with three decimal places"""
+    sign = "-" if value < 0 else ""
+    return f"{sign}{abs(value) // 1000}.{abs(value) % 1000:03d}"
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+""" Synthetic invoices for load testing
+
+Streams any number of invoices, reproducibly from a seed, and can write them
+as an order line export or an invoice store.
+
+    python load_generator.py orders.csv --invoices 1000000 --seed 1
+    python load_generator.py month.store --invoices 5000 --long-tail 40
+"""
+import argparse
+import bisect
+import csv
+import datetime
+import itertools
+import json
+import math
+import random
+import sys
+
+import ingest
+from invoice import Invoice
+from invoice_store import write_invoices
+from order import Order
+from product import Product
+
+# Default catalogue of (name, price)
+PRODUCTS = (
+    ("Milk", 1.2),
+    ("Eggs", 2.5),
+    ("Bread", 1.1),
+    ("Cheese", 3.75),
+    ("Butter", 2.2),
+    ("Coffee", 4.99),
+)
+
+
+def uniform(low, high):
+    """Return a distribution of whole numbers from low to high inclusive"""
+    return lambda rng: rng.randint(low, high)
+
+
+def long_tail(median, sigma=1.0, high=100000):
+    """Return a log-normal distribution of whole numbers from 1 to high
+
+    Most values are near median, with the occasional very large one, like
+    the line counts of a few wholesale customers among many small ones.
+    """
+    mu = math.log(median)
+    return lambda rng: max(1, min(high, round(rng.lognormvariate(mu, sigma))))
+
+
+def get_names(path="data/names.csv"):
+    """Read the customer names of data/names.csv"""
+    with open(path, "r", newline="") as f:
+        return [" ".join(row) for row in csv.reader(f) if row]
+
+
+def make_products(count, seed=0):
+    """Return a catalogue of count (name, price) pairs with seeded prices"""
+    rng = random.Random(f"{seed}/products")
+    return [(f"Product {i + 1}", round(rng.uniform(0.5, 50), 2)) for i in range(count)]
+
+
+class InvoiceGenerator:
+    """Reproducible stream of synthetic invoices
+
+    Every invoice is generated from its own seed, derived from the generator
+    seed and the invoice's index, so invoice(i) is the same whether it is
+    generated on its own, in a stream or in another process.
+
+    Customers are taken from the names list in turn; each pass over the list
+    is invoiced period_days after the previous one, so (customer, invoice
+    date) stays unique however many invoices are generated.
+    """
+
+    def __init__(self, seed=0, names=None, products=PRODUCTS, lines=uniform(1, 5),
+                 quantities=uniform(1, 10), fractional=0.0, skew=0.0,
+                 start=datetime.date(2022, 1, 31), period_days=30, span_days=14):
+        """Initialize generator
+
+        Args:
+            seed (int or str): seed of the whole stream
+            names (list): customer names; defaults to data/names.csv
+            products (list): catalogue of (name, price) pairs
+            lines (callable): distribution of order lines per invoice; takes
+                a random.Random and returns a count, e.g. uniform(1, 5) or
+                long_tail(40)
+            quantities (callable): distribution of order quantities
+            fractional (float): share of order lines with a fractional
+                quantity, like weighed goods
+            skew (float): 0 picks products evenly; higher values favour the
+                start of the catalogue, with weights 1 / rank ** skew
+            start (datetime.date): invoice date of the first pass of names
+            period_days (int): days between passes over the names
+            span_days (int): days before the invoice date orders are placed
+        """
+        self.seed = seed
+        self.names = names or get_names()
+        self.products = [Product(name, price) for name, price in products]
+        weights = [1 / (rank + 1) ** skew for rank in range(len(self.products))]
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.lines = lines
+        self.quantities = quantities
+        self.fractional = fractional
+        self.start = start
+        self.period_days = period_days
+        self.span_days = span_days
+
+    def invoice(self, index):
+        """Return the invoice at a position in the stream"""
+        rng = random.Random(f"{self.seed}/{index}")
+        period, customer = divmod(index, len(self.names))
+        name = self.names[customer]
+        date = self.start + datetime.timedelta(days=period * self.period_days)
+        orders = []
+        for _ in range(self.lines(rng)):
+            order_date = date - datetime.timedelta(days=rng.randrange(self.span_days))
+            quantity = self.quantities(rng)
+            if self.fractional and rng.random() < self.fractional:
+                quantity = round(rng.uniform(0.1, quantity), 2)
+            orders.append(Order(name, quantity, order_date, self.pick_product(rng)))
+        orders.sort(key=lambda order: order.order_date)
+        return Invoice(name, date, orders)
+
+    def pick_product(self, rng):
+        """Pick a product from the catalogue"""
+        point = rng.random() * self.cum_weights[-1]
+        return self.products[bisect.bisect(self.cum_weights, point)]
+
+    def invoices(self, count, first=0):
+        """Yield count invoices, starting from position first"""
+        for index in range(first, first + count):
+            yield self.invoice(index)
+
+
+def write_lines(path, invoices, fmt=None):
+    """Write invoices as an order line export ingest can read
+
+    Args:
+        path (str): path of the export
+        invoices (iterable): Invoice objects
+        fmt (str): "csv" or "jsonl"; guessed from the extension if omitted
+
+    Returns:
+        int: number of invoices written
+    """
+    fmt = fmt or ingest.guess_format(path)
+    count = 0
+    with open(path, "w", newline="") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(ingest.FIELDS)
+        for count, invoice in enumerate(invoices, 1):
+            for order in invoice.orders:
+                row = (
+                    invoice.name, invoice.date.isoformat(), order.order_date.isoformat(),
+                    order.product.name, order.product.price, order.quantity,
+                )
+                if fmt == "csv":
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(ingest.FIELDS, row))) + "\n")
+    return count
+
+
+def write(path, invoices):
+    """Write invoices to an invoice store (.store) or an order line export
+
+    Returns:
+        int: number of invoices written
+    """
+    if path.endswith(".store"):
+        return write_invoices(path, invoices)
+    return write_lines(path, invoices)
+
+
+def main(argv=None):
+    """Generate invoices from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="invoice store (.store), .csv or .jsonl export")
+    parser.add_argument("--invoices", type=int, default=1000, help="invoices to generate")
+    parser.add_argument("--seed", default="0", help="seed of the stream")
+    parser.add_argument("--first", type=int, default=0, help="position of the first invoice")
+    parser.add_argument("--lines", type=int, nargs=2, default=(1, 5), metavar=("LOW", "HIGH"),
+                        help="order lines per invoice")
+    parser.add_argument("--long-tail", type=float, metavar="MEDIAN",
+                        help="log-normal order lines per invoice around MEDIAN instead")
+    parser.add_argument("--quantities", type=int, nargs=2, default=(1, 10), metavar=("LOW", "HIGH"),
+                        help="order quantities")
+    parser.add_argument("--fractional", type=float, default=0.0,
+                        help="share of orders with a fractional quantity")
+    parser.add_argument("--products", type=int, help="size of a generated catalogue")
+    parser.add_argument("--skew", type=float, default=0.0, help="skew of product popularity")
+    parser.add_argument("--span-days", type=int, default=14, help="days of orders per invoice")
+    args = parser.parse_args(argv)
+
+    generator = InvoiceGenerator(
+        seed=args.seed,
+        products=make_products(args.products, args.seed) if args.products else PRODUCTS,
+        lines=long_tail(args.long_tail) if args.long_tail else uniform(*args.lines),
+        quantities=uniform(*args.quantities),
+        fractional=args.fractional,
+        skew=args.skew,
+        span_days=args.span_days,
+    )
+    count = write(args.output, generator.invoices(args.invoices, args.first))
+    print(f"Wrote {count} invoices to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+""" Logo download with HTTP revalidation """
+import json
+import os
+import tempfile
+
+
+class LogoManager:
+    """Keeps a local copy of the logo in sync with its url
+
+    The logo is fetched at most once per batch. Later batches revalidate the
+    local copy with If-None-Match / If-Modified-Since, so an unchanged logo
+    costs a 304 response and no write. New downloads replace the file
+    atomically so readers never see a partial image.
+    """
+
+    def __init__(self, url, path, timeout=5.0):
+        """Initialize logo manager
+
+        Args:
+            url (str): url to download the logo from
+            path (str): local path of the downloaded logo
+            timeout (float): seconds to wait for the logo host
+        """
+        self.url = url
+        self.path = path
+        self.timeout = timeout
+        # ETag and Last-Modified of the local copy
+        self.meta_path = f"{path}.http.json"
+        self.checked = False
+        self.error = ""
+
+    def start_batch(self):
+        """Revalidate the logo on the next call to ensure"""
+        self.checked = False
+
+    def ensure(self):
+        """Fetch the logo unless it was already checked in this batch
+
+        Returns:
+            bool: True if a new logo was written to path
+        """
+        if self.checked:
+            return False
+        self.checked = True
+        return self.fetch()
+
+    def fetch(self):
+        """Download the logo if it changed since the local copy was fetched
+
+        Returns:
+            bool: True if a new logo was written to path
+        """
+        # Imported on first use, as it is slow to import
+        import requests
+
+        self.error = ""
+        meta = self.load_meta()
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            r = requests.get(self.url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.error = f"Failed to download logo from {self.url}: {e}"
+            return False
+        if r.status_code == 304:
+            return False
+        if r.status_code != 200:
+            self.error = f"Failed to download logo from {self.url}: HTTP {r.status_code}"
+            return False
+        write_atomic(self.path, r.content)
+        meta = {
+            "url": self.url,
+            "etag": r.headers.get("ETag", ""),
+            "last_modified": r.headers.get("Last-Modified", ""),
+        }
+        write_atomic(self.meta_path, json.dumps(meta).encode())
+        return True
+
+    def load_meta(self):
+        """Return the validators of the local copy, if it is still usable"""
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if meta.get("url") != self.url:
+            return {}
+        return meta
+
+
+def write_atomic(path, data):
+    """Write bytes to path by renaming a temporary file over it"""
+    folder = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+_managers = {}
+
+
+def get_logo_manager(url, path):
+    """Return the logo manager shared by this process for url and path"""
+    key = (url, path)
+    if key not in _managers:
+        _managers[key] = LogoManager(url, path)
+    return _managers[key]
@@ -0,0 +1,143 @@
+""" Logo preparation for embedding in invoices """
+import hashlib
+import io
+import json
+
+from branding import file_stamp
+from logo import write_atomic
+
+# Resolution the logo is resampled to for the size it is placed at
+LOGO_DPI = 300
+# Bump whenever the output of build changes, so logos are rebuilt
+PIPELINE_VERSION = 1
+
+
+class LogoAsset:
+    """Copy of the logo optimised for the size invoices place it at
+
+    The source is downsampled to dpi for the placed size, flattened onto
+    the white page and saved without metadata as a greyscale or palette PNG
+    when that is lossless, or quantised to a palette when lossy is allowed.
+    Without an alpha channel FPDF embeds the PNG's compressed pixel data
+    as-is, instead of decompressing it to split out the transparency.
+
+    The hash of the source and the settings is stored next to the copy, so
+    it is rebuilt when either changes. Files are only hashed again when
+    their mtime or size changes.
+    """
+
+    def __init__(self, source, target, size, dpi=LOGO_DPI, lossy=False):
+        """Initialize logo asset
+
+        Args:
+            source (str): path of the original logo
+            target (str): path of the optimised png
+            size (tuple): width and height the logo is placed at, in mm
+            dpi (int): resolution to downsample to
+            lossy (bool): quantise logos with more than 256 colours to a
+                palette, rather than keeping them in full colour
+        """
+        self.source = source
+        self.target = target
+        self.size = size
+        self.dpi = dpi
+        self.lossy = lossy
+        # Hash of the source and settings the target was built from
+        self.meta_path = f"{target}.source.json"
+        # Stamps of the source and target when the target was last current
+        self.checked = None
+
+    def ensure(self):
+        """Rebuild the target if it is missing or its source changed
+
+        Returns:
+            bool: True if the target was rebuilt
+        """
+        stamps = (file_stamp(self.source), file_stamp(self.target))
+        if stamps == self.checked:
+            return False
+        if stamps[0] is None and stamps[1] is not None:
+            # Keep the last optimised logo while there is no source
+            return False
+        digest = self.digest()
+        rebuilt = stamps[1] is None or self.load_meta().get("source") != digest
+        if rebuilt:
+            self.build(digest)
+        self.checked = (file_stamp(self.source), file_stamp(self.target))
+        return rebuilt
+
+    def digest(self):
+        """Return a hash of the source and the settings"""
+        h = hashlib.sha256(repr((PIPELINE_VERSION, self.size, self.dpi, self.lossy)).encode())
+        with open(self.source, "rb") as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def pixel_size(self):
+        """Return the largest width and height needed at dpi, in pixels"""
+        return tuple(max(1, round(mm / 25.4 * self.dpi)) for mm in self.size)
+
+    def build(self, digest=None):
+        """Write the optimised logo and the hash it was built from"""
+        # Imported on first use, as it is slow to import
+        from PIL import Image
+
+        digest = digest or self.digest()
+        img = Image.open(self.source)
+        img.load()
+        grey = img.mode in ("1", "L", "LA", "I", "F") or \
+            (img.mode == "P" and img.palette.mode in ("L", "LA"))
+        img = img.convert("RGBA")
+        img.thumbnail(self.pixel_size(), Image.LANCZOS)
+        # The logo is drawn on white, so transparency can be applied now
+        page = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(page, img).convert("RGB")
+        if grey:
+            img = img.convert("L")
+        else:
+            colors = img.getcolors(256)
+            if colors is not None:
+                img = to_palette(img, [color for _, color in colors])
+            elif self.lossy:
+                img = img.quantize(256)
+        # Drop profiles, timestamps and other metadata
+        img.info = {}
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG", optimize=True)
+        write_atomic(self.target, buffer.getvalue())
+        write_atomic(self.meta_path, json.dumps({"source": digest}).encode())
+
+    def load_meta(self):
+        """Return the hash the target was built from, if known"""
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def to_palette(img, colors):
+    """Convert an RGB image to a palette image with exactly these colours
+
+    Image.quantize matches colours at reduced precision, so the pixels are
+    mapped to their palette index here instead.
+    """
+    from PIL import Image
+
+    index = {bytes(color): i for i, color in enumerate(colors)}
+    data = img.tobytes()
+    pixels = bytes(index[data[i: i + 3]] for i in range(0, len(data), 3))
+    palette = Image.frombytes("P", img.size, pixels)
+    palette.putpalette([channel for color in colors for channel in color])
+    return palette
+
+
+_assets = {}
+
+
+def get_logo_asset(source, target, size, dpi=LOGO_DPI, lossy=False):
+    """Return the logo asset shared by this process for these settings"""
+    key = (source, target, size, dpi, lossy)
+    if key not in _assets:
+        _assets[key] = LogoAsset(source, target, size, dpi, lossy)
+    return _assets[key]
@@ -1,19 +1,50 @@
 """ Order class """
+from decimal import ROUND_HALF_UP, Decimal
+
+PENNY = Decimal("0.01")
 
 
 class Order:
-    """Order data class"""
-    def __init__(self, name, quantity, order_date, product):
-        """ Initialize order """
+    """Order data class
+
+    Orders are immutable, so the invoices holding them can index them.
+    """
+    __slots__ = ("name", "quantity", "order_date", "product", "cost")
+
+    def __init__(self, name, quantity, order_date, product, cost=None):
+        """ Initialize order
+
+        Args:
+            cost (float): cost of the order if already known, e.g. from an
+                OrderTable; calculated otherwise
+        """
         self.name = name
         self.quantity = quantity
         self.order_date = order_date
         self.product = product
-        self.cost = self.calculate_cost()
+        self.cost = self.calculate_cost() if cost is None else cost
+
+    def __setattr__(self, name, value):
+        """ Set an attribute once """
+        if hasattr(self, name):
+            raise AttributeError(f"Order.{name} cannot be changed")
+        super().__setattr__(name, value)
+
+    def __setstate__(self, state):
+        """ Restore pickles of both slotted and older dict-based objects"""
+        if isinstance(state, tuple):
+            state = state[1]
+        for key, value in state.items():
+            setattr(self, key, value)
 
     def calculate_cost(self):
-        """ Calculate cost of purchase and force 2 decimal places"""
-        return round(self.quantity * self.product.price, 2)
+        """ Calculate cost of purchase, rounded half up to the nearest penny
+
+        Uses the same rule as OrderTable, so an invoice costs the same
+        however its orders are stored.
+        """
+        cost = Decimal(str(self.quantity)) * Decimal(str(self.product.price))
+        return float(cost.quantize(PENNY, rounding=ROUND_HALF_UP))
 
     def get_date(self):
         """ Return the order date """
@@ -0,0 +1,140 @@
+""" Columnar order storage """
+import datetime
+from array import array
+from decimal import Decimal
+
+from order import Order
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class OrderTable:
+    """Orders of one invoice stored as typed columns
+
+    Each order takes a few bytes per column instead of an Order object with
+    its own dict of attributes. Prices are kept in integer pence and
+    quantities in thousandths, so line costs and totals are exact. A price
+    or quantity with more decimal places raises ValueError rather than
+    being rounded. Iterating yields Order objects, so a table can stand in
+    for the list of orders of an Invoice.
+    """
+
+    def __init__(self, name, orders=()):
+        """Initialize order table
+
+        Args:
+            name (str): customer name shared by every order
+            orders (iterable): Order objects to start with
+        """
+        self.name = name
+        # Distinct products, indexed by product id
+        self.products = []
+        self.product_index = {}
+        self.prices = array("q")
+        # One entry per order
+        self.product_column = array("I")
+        self.quantities = array("q")
+        self.dates = array("I")
+        for order in orders:
+            self.append(order)
+
+    def product_id(self, product):
+        """Return the id of a product, adding it if it is new"""
+        key = (product.name, product.price)
+        if key not in self.product_index:
+            price = to_hundredths(product.price)
+            self.product_index[key] = len(self.products)
+            self.products.append(product)
+            self.prices.append(price)
+        return self.product_index[key]
+
+    def append(self, order):
+        """Add an order"""
+        self.add_order(order.name, order.order_date, order.quantity, order.product)
+
+    def add_order(self, name, order_date, quantity, product):
+        """Add an order, with the same arguments as Invoice.add_order"""
+        quantity = to_thousandths(quantity)
+        self.product_column.append(self.product_id(product))
+        self.quantities.append(quantity)
+        self.dates.append(order_date.toordinal())
+
+    def line_costs(self):
+        """Return the cost of every order in pence
+
+        Costs are rounded half up to the nearest penny.
+        """
+        if np is not None and len(self):
+            prices = np.frombuffer(self.prices, dtype=np.int64)
+            product_ids = np.frombuffer(self.product_column, dtype=np.uint32)
+            quantities = np.frombuffer(self.quantities, dtype=np.int64)
+            return (quantities * prices[product_ids] + 500) // 1000
+        prices = self.prices
+        return array(
+            "q",
+            [
+                (quantity * prices[product_id] + 500) // 1000
+                for product_id, quantity in zip(self.product_column, self.quantities)
+            ],
+        )
+
+    def total_pence(self):
+        """Return the total cost of every order in pence"""
+        return int(sum(self.line_costs()))
+
+    def total(self):
+        """Return the total cost of every order in pounds"""
+        return Decimal(self.total_pence()) / 100
+
+    def __len__(self):
+        """Return the number of orders"""
+        return len(self.product_column)
+
+    def __iter__(self):
+        """Yield the orders as Order objects"""
+        costs = self.line_costs()
+        for i, product_id in enumerate(self.product_column):
+            quantity = from_thousandths(self.quantities[i])
+            order_date = datetime.date.fromordinal(self.dates[i])
+            product = self.products[product_id]
+            yield Order(self.name, quantity, order_date, product, int(costs[i]) / 100)
+
+    def __eq__(self, other):
+        """ Override the default Equals behavior"""
+        if isinstance(other, OrderTable):
+            return self.name == other.name and \
+                self.products == other.products and \
+                self.product_column == other.product_column and \
+                self.quantities == other.quantities and \
+                self.dates == other.dates
+        return list(self) == list(other)
+
+
+def to_hundredths(value):
+    """Convert a price or cost to an integer number of hundredths"""
+    return to_units(value, 100)
+
+
+def to_thousandths(value):
+    """Convert a quantity to an integer number of thousandths"""
+    return to_units(value, 1000)
+
+
+def to_units(value, scale):
+    """Convert a number to an integer number of 1/scale units
+
+    Raises:
+        ValueError: if the value has more decimal places than the scale holds
+    """
+    units = Decimal(str(value)) * scale
+    if units != units.to_integral_value():
+        raise ValueError(f"{value} has more than {len(str(scale)) - 1} decimal places")
+    return int(units)
+
+
+def from_thousandths(value):
+    """Convert thousandths back to an int or float"""
+    return value // 1000 if value % 1000 == 0 else value / 1000
@@ -0,0 +1,233 @@
+""" Batch rendering of invoices """
+import os
+import time
+import traceback
+from multiprocessing import Pool, parent_process, util
+
+from branding import get_branding
+from invoice_pdf import PdfInvoice, dprint
+from logo import get_logo_manager
+from output_sink import FolderSink
+from profiling import profiler
+from render_cache import RenderCache
+
+# Render options of the current worker process, set by init_worker
+_options = {}
+# Manifest of the output folder in incremental runs
+_cache = None
+# Where the current worker process writes pdfs
+_sink = None
+
+
+class RenderResult:
+    """Outcome of rendering one invoice"""
+
+    def __init__(self, index, name, filename, seconds, error=None, spans=None,
+                 digest=None, skipped=False, data=None):
+        """Initialize result
+
+        Args:
+            index (int): position of the invoice in the batch
+            name (str): customer name
+            filename (str): path of the generated pdf, None on failure
+            seconds (float): time spent rendering the invoice
+            error (str): traceback of the failure, None on success
+            spans (dict): profiler snapshot of the render, if profiling
+            digest (str): content hash of the invoice, in incremental runs
+            skipped (bool): the existing pdf was up to date
+            data (bytes): the pdf, for sinks the parent process writes to
+        """
+        self.index = index
+        self.name = name
+        self.filename = filename
+        self.seconds = seconds
+        self.error = error
+        self.spans = spans
+        self.digest = digest
+        self.skipped = skipped
+        self.data = data
+
+    @property
+    def ok(self):
+        """Return whether the invoice was rendered"""
+        return self.error is None
+
+    def __str__(self):
+        """Return a string representation of the result"""
+        status = "skipped" if self.skipped else "ok" if self.ok else "failed"
+        return f"{self.index:<8} {status:<8} {self.seconds * 1000:>8.1f}ms {self.name}"
+
+
+def init_worker(options):
+    """Warm a worker process before it renders its first invoice"""
+    global _options, _cache, _sink
+    _options = options
+    _cache = RenderCache(options["folder"]) if options.get("incremental") else None
+    _sink = options.get("sink") or FolderSink(options["folder"])
+    profiler.enable(options.get("profile", False))
+    if parent_process() is not None:
+        # Forked workers start with a copy of the parent's spans
+        profiler.reset()
+        if _sink.parallel:
+            # Sync the last files this worker wrote when it exits
+            util.Finalize(_sink, _sink.close, exitpriority=10)
+    branding = get_branding()
+    if options.get("check_interval") is not None:
+        branding.check_interval = options["check_interval"]
+    if branding.logo_url and options["logo_checked"]:
+        # The parent already fetched the logo for this batch
+        get_logo_manager(branding.logo_url, branding.logo_path).checked = True
+    PdfInvoice(None, compiled=options["compiled"]).preload()
+
+
+def prepare_batch(compiled):
+    """Fetch the logo once for a batch and warm this process before workers start
+
+    The logo and branding are refreshed here rather than left to add_logo,
+    which a cached page template skips. A changed logo changes the
+    template key, so the template is rebuilt.
+    """
+    branding = get_branding()
+    branding.refresh(force=True)
+    if branding.logo_url:
+        logo = get_logo_manager(branding.logo_url, branding.logo_path)
+        logo.start_batch()
+        if logo.ensure():
+            dprint(f"[INFO] Logo downloaded from {branding.logo_url}")
+        elif logo.error:
+            dprint(f"[ERROR] {logo.error}")
+    generate = PdfInvoice(None, compiled=compiled, branding=branding)
+    if generate.logo_asset().ensure():
+        branding.refresh(force=True)
+    generate.preload()
+
+
+def render_invoice(item):
+    """Render one (index, invoice) pair, capturing any failure"""
+    index, invoice = item
+    name = getattr(invoice, "name", None)
+    start = time.perf_counter()
+    digest = None
+    skipped = False
+    data = None
+    try:
+        generate = PdfInvoice(invoice, compiled=_options["compiled"])
+        filename = _sink.filename(generate)
+        if _cache is not None:
+            digest = generate.content_hash()
+            skipped = _cache.is_current(filename, digest)
+        if not skipped:
+            data = generate.render_to_bytes()
+            if _sink.parallel:
+                _sink.write(filename, data)
+                data = None
+        error = None
+    except Exception:
+        filename = None
+        error = traceback.format_exc()
+    seconds = time.perf_counter() - start
+    spans = None
+    if profiler.enabled:
+        # Hand this render's spans to the parent, which aggregates them
+        spans = profiler.snapshot()
+        profiler.reset()
+    return RenderResult(index, name, filename, seconds, error, spans, digest, skipped, data)
+
+
+def render_invoice_bytes(invoice, compiled=True):
+    """Render one invoice and return the pdf bytes"""
+    return PdfInvoice(invoice, compiled=compiled).render_to_bytes()
+
+
+class BatchRenderer:
+    """Renders batches of invoices across a pool of warm worker processes"""
+
+    def __init__(self, processes=None, chunksize=16, compiled=True, folder="invoices",
+                 incremental=False, sink=None):
+        """Initialize batch renderer
+
+        Args:
+            processes (int): worker processes; 1 renders in this process
+            chunksize (int): invoices handed to a worker at a time
+            compiled (bool): render on the compiled page template
+            folder (str): folder the pdf files are written to
+            incremental (bool): skip invoices whose pdf is already up to
+                date, according to the folder's render manifest
+            sink (FolderSink or ArchiveSink): where the pdfs are written;
+                defaults to one file per invoice in folder
+        """
+        self.processes = processes or os.cpu_count()
+        self.chunksize = chunksize
+        self.compiled = compiled
+        self.folder = folder
+        self.incremental = incremental
+        self.sink = sink or FolderSink(folder)
+
+    def render(self, invoices):
+        """Render invoices, yielding a RenderResult per invoice as it finishes
+
+        Results arrive in completion order; use RenderResult.index to match
+        them to the input. A failing invoice yields a result with its error
+        instead of stopping the batch.
+
+        Args:
+            invoices (iterable): Invoice objects, consumed lazily
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        prepare_batch(self.compiled)
+        options = {
+            "compiled": self.compiled,
+            "folder": self.folder,
+            "logo_checked": True,
+            "profile": profiler.enabled,
+            "incremental": self.incremental,
+            "sink": self.sink,
+        }
+        # Only files in the output folder can be checked on the next run
+        cache = RenderCache(self.folder) if self.incremental and self.sink.parallel else None
+        try:
+            for result in self.iter_results(enumerate(invoices), options):
+                if result.spans:
+                    profiler.merge(result.spans)
+                if result.data is not None:
+                    self.sink.write(result.filename, result.data)
+                    result.data = None
+                if cache is not None and result.ok and not result.skipped:
+                    cache.record(result.filename, result.digest)
+                yield result
+        except BaseException:
+            getattr(self.sink, "abort", self.sink.close)()
+            raise
+        self.sink.close()
+
+    def iter_results(self, items, options):
+        """Yield the RenderResult of each (index, invoice) pair"""
+        if self.processes == 1:
+            init_worker(options)
+            for item in items:
+                yield render_invoice(item)
+            return
+        with Pool(self.processes, initializer=init_worker, initargs=(options,)) as pool:
+            yield from pool.imap_unordered(render_invoice, items, self.chunksize)
+            # Let workers exit normally, so their sinks are synced
+            pool.close()
+            pool.join()
+
+    def run(self, invoices, progress=None):
+        """Render invoices and return the failures
+
+        Args:
+            invoices (iterable): Invoice objects
+            progress (callable): called with each RenderResult and the number
+                of invoices finished so far
+
+        Returns:
+            list: RenderResult of every invoice that failed
+        """
+        failures = []
+        for done, result in enumerate(self.render(invoices), 1):
+            if not result.ok:
+                failures.append(result)
+            if progress:
+                progress(result, done)
+        return failures
@@ -0,0 +1,181 @@
+""" Destinations for rendered invoice pdfs """
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+
+
+class FolderSink:
+    """Writes each pdf to its own file under a folder
+
+    Files are written under a temporary name and renamed into place, so a
+    pdf that exists is always complete. With sync_batch set, written files
+    and their folders are fsynced that many files at a time, rather than
+    once per file.
+
+    Sinks hold no open files until they are written to, so a sink can be
+    handed to pool workers that all write to the same folder.
+    """
+
+    # Pool workers can write to the sink themselves
+    parallel = True
+
+    def __init__(self, folder="invoices", shards=0, unique=False, sync_batch=0):
+        """Initialize folder sink
+
+        Args:
+            folder (str): folder the pdf files are written to
+            shards (int): levels of subfolders, named after the hash of the
+                file name, e.g. 2 gives invoices/3f/a2/<file>
+            unique (bool): add an id derived from the invoice to each file
+                name, so customers sharing a name do not overwrite each other
+            sync_batch (int): files written between fsyncs; 0 to leave
+                flushing to the operating system
+        """
+        self.folder = folder
+        self.shards = shards
+        self.unique = unique
+        self.sync_batch = sync_batch
+        # Files written since the last sync
+        self.unsynced = []
+
+    def filename(self, generate):
+        """Return the path the pdf of a PdfInvoice is written to"""
+        name = pdf_name(generate, self.unique)
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        shards = [digest[2 * i: 2 * i + 2] for i in range(self.shards)]
+        return os.path.join(self.folder, *shards, name)
+
+    def write(self, filename, data):
+        """Write a pdf atomically"""
+        folder = os.path.dirname(filename) or "."
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp_")
+        try:
+            # mkstemp creates files only the owner can read
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if self.sync_batch:
+            self.unsynced.append(filename)
+            if len(self.unsynced) >= self.sync_batch:
+                self.flush()
+
+    def flush(self):
+        """Fsync the files written since the last flush, and their folders"""
+        folders = set()
+        for filename in self.unsynced:
+            fsync_path(filename, os.O_RDONLY)
+            folders.add(os.path.dirname(filename) or ".")
+        for folder in folders:
+            fsync_path(folder, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+        self.unsynced = []
+
+    def close(self):
+        """Flush any files that were not synced yet"""
+        self.flush()
+
+    def files(self):
+        """Yield the path of every pdf in the folder and its shards"""
+        for root, folders, names in os.walk(self.folder):
+            folders.sort()
+            for name in sorted(names):
+                if name.endswith(".pdf"):
+                    yield os.path.join(root, name)
+
+
+class ArchiveSink:
+    """Streams the pdfs of a batch into one zip or tar archive
+
+    The archive is built under a temporary name and renamed into place when
+    the sink is closed. Members are stored uncompressed, as the pdf streams
+    are already compressed.
+    """
+
+    # Only the process that owns the archive can write to it
+    parallel = False
+
+    def __init__(self, path, unique=True):
+        """Initialize archive sink
+
+        Args:
+            path (str): archive to create, ending in .zip, .tar or .tar.gz
+            unique (bool): add an id derived from the invoice to each name
+        """
+        self.path = path
+        self.unique = unique
+        self.tmp = None
+        self.archive = None
+
+    def filename(self, generate):
+        """Return the name of the pdf of a PdfInvoice within the archive"""
+        return pdf_name(generate, self.unique)
+
+    def open(self):
+        """Create the temporary archive"""
+        folder = os.path.dirname(self.path) or "."
+        fd, self.tmp = tempfile.mkstemp(dir=folder, prefix=".tmp_")
+        os.close(fd)
+        if self.path.endswith(".zip"):
+            self.archive = zipfile.ZipFile(self.tmp, "w", zipfile.ZIP_STORED)
+        elif self.path.endswith((".tar.gz", ".tgz")):
+            self.archive = tarfile.open(self.tmp, "w:gz")
+        else:
+            self.archive = tarfile.open(self.tmp, "w")
+
+    def write(self, filename, data):
+        """Add a pdf to the archive"""
+        if self.archive is None:
+            self.open()
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(filename, data)
+        else:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mtime = time.time()
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        """Finish the archive and move it into place"""
+        if self.archive is None:
+            self.open()
+        self.archive.close()
+        self.archive = None
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        """Discard the partially written archive"""
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+            os.unlink(self.tmp)
+
+
+def pdf_name(generate, unique=False):
+    """Return the file name of the pdf of a PdfInvoice
+
+    Args:
+        generate (PdfInvoice): invoice being rendered
+        unique (bool): add an id derived from the invoice
+    """
+    name = os.path.basename(generate.filename())
+    if unique:
+        stem, ext = os.path.splitext(name)
+        name = f"{stem}_{generate.invoice_id()}{ext}"
+    return name
+
+
+def fsync_path(path, flags):
+    """Fsync a file or folder by path"""
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,89 @@
+""" Precompiled invoice page template """
+import copy
+
+# FPDF attributes describing the current drawing state
+STATE_ATTRS = (
+    "font_family",
+    "font_style",
+    "font_size_pt",
+    "font_size",
+    "current_font",
+    "unifontsubset",
+    "underline",
+    "draw_color",
+    "fill_color",
+    "text_color",
+    "color_flag",
+    "x",
+    "y",
+    "lasth",
+)
+
+
+def save_state(pdf):
+    """Return a snapshot of the drawing state of an FPDF document"""
+    return {attr: getattr(pdf, attr, None) for attr in STATE_ATTRS}
+
+
+def restore_state(pdf, state):
+    """Restore a drawing state captured with save_state"""
+    for attr, value in state.items():
+        setattr(pdf, attr, value)
+
+
+class PageTemplate:
+    """Page skeleton holding the static layout of an invoice
+
+    The skeleton is an FPDF document with one open page containing every
+    element that is identical across invoices. The footer is the raw content
+    stream of the Notes/Terms blocks, drawn with the order table ending at
+    row 0, so it can be shifted down to wherever the table ends.
+    """
+
+    def __init__(self, skeleton, footer):
+        """Initialize template"""
+        self.skeleton = skeleton
+        self.footer = footer
+
+    def instantiate(self):
+        """Return a new FPDF document starting from the skeleton page"""
+        pdf = copy.copy(self.skeleton)
+        # Containers that FPDF mutates while drawing or writing out
+        pdf.offsets = {}
+        pdf.buffer = ""
+        pdf.pages = dict(self.skeleton.pages)
+        pdf.page_links = dict(self.skeleton.page_links)
+        pdf.links = dict(self.skeleton.links)
+        pdf.orientation_changes = dict(self.skeleton.orientation_changes)
+        pdf.font_files = dict(self.skeleton.font_files)
+        pdf.diffs = dict(self.skeleton.diffs)
+        # Font and image entries get their object numbers (and images lose
+        # their data) when a document is written, so each copy needs its own
+        pdf.fonts = {key: dict(font) for key, font in self.skeleton.fonts.items()}
+        pdf.images = {key: dict(info) for key, info in self.skeleton.images.items()}
+        if self.skeleton.font_family:
+            fontkey = self.skeleton.font_family + self.skeleton.font_style
+            pdf.current_font = pdf.fonts[fontkey]
+        return pdf
+
+    def add_page(self, pdf):
+        """Add a page starting from the skeleton to a document it created"""
+        for key, font in self.skeleton.fonts.items():
+            if pdf.fonts.get(key, {}).get("i") != font["i"]:
+                raise ValueError("Document was not created from this page template")
+        for key, info in self.skeleton.images.items():
+            if pdf.images.get(key, {}).get("i") != info["i"]:
+                raise ValueError("Document was not created from this page template")
+        pdf.add_page()
+        pdf.pages[pdf.page] = self.skeleton.pages[self.skeleton.page]
+        restore_state(pdf, save_state(self.skeleton))
+        if self.skeleton.font_family:
+            fontkey = self.skeleton.font_family + self.skeleton.font_style
+            pdf.current_font = pdf.fonts[fontkey]
+
+    def add_footer(self, pdf, row):
+        """Draw the precompiled Notes/Terms blocks below the given row"""
+        # Translate the footer down by row mm; PDF y axis points up
+        pdf._out(f"q 1 0 0 1 0 {-row * pdf.k:.2f} cm")
+        pdf.pages[pdf.page] += self.footer
+        pdf._out("Q")
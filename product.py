@@ -2,12 +2,30 @@
 
 
 class Product:
-    """ Return the product name and price """
+    """ Return the product name and price
+
+    Products are immutable, like the orders that hold them.
+    """
+    __slots__ = ("name", "price")
+
     def __init__(self, name, price):
         """ Initialize product """
         self.name = name
         self.price = price
 
+    def __setattr__(self, name, value):
+        """ Set an attribute once """
+        if hasattr(self, name):
+            raise AttributeError(f"Product.{name} cannot be changed")
+        super().__setattr__(name, value)
+
+    def __setstate__(self, state):
+        """ Restore pickles of both slotted and older dict-based objects"""
+        if isinstance(state, tuple):
+            state = state[1]
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def __str__(self):
         """ Return the product name and price """
         return f"{self.name} {str(self.price)}"
@@ -0,0 +1,165 @@
+""" Timing instrumentation for invoice rendering """
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    """Distribution of span durations"""
+
+    def __init__(self, buckets=BUCKETS):
+        """Initialize histogram"""
+        self.buckets = buckets
+        # One count per bucket, plus one for durations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        """Record a duration"""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, data):
+        """Add the counts of a histogram exported with to_dict"""
+        for i, count in enumerate(data["counts"]):
+            self.counts[i] += count
+        self.sum += data["sum"]
+        self.count += data["count"]
+
+    def to_dict(self):
+        """Return the histogram as plain data"""
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class Span:
+    """Times the block it wraps"""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class NullSpan:
+    """Stands in for Span when profiling is disabled"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler:
+    """Collects span durations into one histogram per span name
+
+    Disabled profilers hand out a shared no-op span, so instrumented code
+    only pays for an attribute check.
+    """
+
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        """Initialize profiler"""
+        self.enabled = enabled
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        """Turn span collection on or off"""
+        self.enabled = enabled
+
+    def span(self, name):
+        """Return a context manager timing the block it wraps"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, seconds):
+        """Record the duration of a span"""
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.buckets)
+            self.histograms[name].observe(seconds)
+
+    def snapshot(self):
+        """Return every histogram as plain data, e.g. to send between processes"""
+        with self.lock:
+            return {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+
+    def merge(self, snapshot):
+        """Add the histograms of a snapshot, e.g. one taken in a pool worker"""
+        with self.lock:
+            for name, data in snapshot.items():
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram(self.buckets)
+                self.histograms[name].merge(data)
+
+    def reset(self):
+        """Drop every recorded span"""
+        with self.lock:
+            self.histograms = {}
+
+    def to_json(self):
+        """Export the histograms as JSON"""
+        return json.dumps({"buckets": list(self.buckets), "spans": self.snapshot()}, indent=2)
+
+    def to_prometheus(self, metric="invoice_render_span_seconds"):
+        """Export the histograms in the Prometheus text format"""
+        lines = [
+            f"# HELP {metric} Time spent in each invoice rendering span.",
+            f"# TYPE {metric} histogram",
+        ]
+        for name, data in sorted(self.snapshot().items()):
+            cumulative = 0
+            bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, data["counts"]):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {data["sum"]:.9f}')
+            lines.append(f'{metric}_count{{span="{name}"}} {data["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+def timed(name):
+    """Decorate a method so each call is recorded as a span"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with Span(profiler, name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Profiler shared by this process; INVOICE_PROFILE=1 enables it at start up
+profiler = Profiler(enabled=os.environ.get("INVOICE_PROFILE", "") not in ("", "0"))
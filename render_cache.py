@@ -0,0 +1,52 @@
+""" Manifest of rendered invoices for incremental runs """
+import json
+import os
+
+
+class RenderCache:
+    """Records the content hash of every pdf written to an output folder
+
+    The manifest is an append-only JSON lines file mapping each output file
+    to the hash of the content it was rendered from; the last entry for a
+    file wins. An invoice can be skipped when its output file exists and was
+    last rendered from the same hash.
+    """
+
+    def __init__(self, folder="invoices", manifest=".manifest.jsonl"):
+        """Initialize render cache
+
+        Args:
+            folder (str): output folder the manifest describes
+            manifest (str): manifest file name within folder
+        """
+        self.path = os.path.join(folder, manifest)
+        # filename -> content hash
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """Read the manifest, ignoring a torn last line"""
+        self.entries = {}
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.entries[entry["filename"]] = entry["hash"]
+
+    def is_current(self, filename, digest):
+        """Return whether filename exists and was rendered from digest"""
+        return digest is not None and \
+            self.entries.get(filename) == digest and \
+            os.path.exists(filename)
+
+    def record(self, filename, digest):
+        """Add a rendered file to the manifest"""
+        if digest is None or self.entries.get(filename) == digest:
+            return
+        self.entries[filename] = digest
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"filename": filename, "hash": digest}) + "\n")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+""" Render server
+
+Keeps a pool of warm worker processes and renders invoices posted to it as
+JSON, over HTTP or a Unix socket, returning the pdf.
+
+    python render_server.py --port 8080
+    python render_server.py --socket /tmp/invoices.sock
+    curl --data @invoice.json http://localhost:8080/render > invoice.pdf
+
+The JSON object holds the customer and invoice_date of the invoice, and an
+orders list with the order_date, product, price and quantity of each line.
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ingest
+from orders import init_worker, prepare_batch, render_invoice_bytes
+
+
+class RenderPool:
+    """Worker processes that are warmed up before the first request
+
+    The logo, branding, images, fonts and page template are loaded in this
+    process first, so forked workers start with them already in memory.
+    """
+
+    def __init__(self, processes=None, compiled=True, refresh_interval=60):
+        """Start the workers
+
+        Args:
+            processes (int): worker processes
+            compiled (bool): render on the compiled page template
+            refresh_interval (float): seconds between revalidating the logo
+                and re-checking the branding files; None to never refresh
+        """
+        self.processes = processes or os.cpu_count()
+        self.compiled = compiled
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        prepare_batch(compiled)
+        self.prepared = time.monotonic()
+        options = {
+            "compiled": compiled,
+            "folder": None,
+            "logo_checked": True,
+            # Workers pick up the logo and branding files the server refreshes
+            "check_interval": refresh_interval,
+        }
+        self.executor = ProcessPoolExecutor(
+            self.processes, initializer=init_worker, initargs=(options,)
+        )
+        # Workers are started on demand, so start them all now
+        for future in [self.executor.submit(os.getpid) for _ in range(self.processes)]:
+            future.result()
+
+    def refresh(self):
+        """Revalidate the logo and branding once refresh_interval has passed"""
+        if self.refresh_interval is None:
+            return
+        with self.lock:
+            if time.monotonic() - self.prepared >= self.refresh_interval:
+                prepare_batch(self.compiled)
+                self.prepared = time.monotonic()
+
+    def render(self, invoice):
+        """Render an invoice on a worker and return the pdf bytes"""
+        self.refresh()
+        return self.executor.submit(render_invoice_bytes, invoice, self.compiled).result()
+
+    def close(self):
+        """Stop the workers"""
+        self.executor.shutdown()
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """Handles POST /render and GET /health"""
+
+    def do_GET(self):
+        """Report that the server is up"""
+        if self.path != "/health":
+            self.send_error(404)
+            return
+        self.send_body(200, "text/plain", b"ok\n")
+
+    def do_POST(self):
+        """Render the invoice in the request body"""
+        if self.path != "/render":
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            invoice = ingest.parse_invoice(json.loads(self.rfile.read(length)))
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_error(400, f"Invalid invoice: {e!r}")
+            return
+        try:
+            data = self.server.pool.render(invoice)
+        except Exception:
+            self.log_error("%s", traceback.format_exc())
+            self.send_error(500, "Render failed")
+            return
+        self.send_body(200, "application/pdf", data)
+
+    def send_body(self, status, content_type, body):
+        """Send a complete response"""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        """Return the client address, which is empty on Unix sockets"""
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+
+class RenderServer(ThreadingHTTPServer):
+    """HTTP server rendering invoices on a RenderPool"""
+
+    daemon_threads = True
+
+    def __init__(self, address, pool):
+        """Listen on a (host, port) address"""
+        super().__init__(address, RenderHandler)
+        self.pool = pool
+
+
+class UnixRenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP over a Unix socket, rendering invoices on a RenderPool"""
+
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        """Listen on a Unix socket, replacing a stale one left at path"""
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, RenderHandler)
+        self.pool = pool
+
+    def server_close(self):
+        """Close the socket and remove its file"""
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def main(argv=None):
+    """Run the render server from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--socket", help="listen on this Unix socket instead")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--classic", action="store_true", help="render without the page template")
+    parser.add_argument(
+        "--refresh-interval", type=float, default=60,
+        help="seconds between revalidating the logo and branding files",
+    )
+    args = parser.parse_args(argv)
+
+    pool = RenderPool(args.processes, not args.classic, args.refresh_interval)
+    if args.socket:
+        server = UnixRenderServer(args.socket, pool)
+    else:
+        server = RenderServer((args.host, args.port), pool)
+    print(f"Rendering on {server.server_address} with {pool.processes} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,17 +1,59 @@
 #!/usr/bin/env python
+import asyncio
+import contextlib
 import csv
 import datetime
+import http.server
+import io
+import json
 import os
 import pickle
 import random
+import shutil
+import socket
+import tarfile
+import tempfile
+import threading
 import time
 import unittest
-from multiprocessing import Pool
+import unittest.mock
+import urllib.error
+import urllib.request
+import zipfile
+from decimal import Decimal
 
+from fpdf import FPDF
+from PIL import Image
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+import benchmark
+import ingest
+import invoice_pdf
+import job_queue
+import load_generator
+import orders
+from async_render import AsyncRenderer
+from branding import BrandingConfig
+from drawing import fill_rounded_rect, set_draw_color, write_text
+from image_cache import ImageCache
 from invoice import Invoice
-from invoice_pdf import PdfInvoice
+from invoice_pdf import PdfInvoice, iter_documents
+from invoice_store import InvoiceStore, write_invoices
+from ledger import Ledger
+from load_generator import InvoiceGenerator, long_tail
+from logo import LogoManager
+from logo_asset import LogoAsset
 from order import Order
+from order_table import OrderTable
+from orders import BatchRenderer
+from output_sink import ArchiveSink, FolderSink
 from product import Product
+from profiling import profiler
+from render_server import RenderPool, RenderServer, UnixRenderServer
 
 
 def get_names():
@@ -73,7 +115,7 @@ def get_invoice_objects(num_invoices):
             price = round(random.uniform(1, 5), 2)
             products.append(Product(product_name, price))
 
-        orders = []
+        invoice = Invoice(name, None, [])
         # Generate random number of orders with random quantities/costs
         for _ in range(random.randint(1, 5)):
             # Generate a date within the last two weeks
@@ -81,13 +123,12 @@ def get_invoice_objects(num_invoices):
             # Get random product
             product = random.choice(products)
             # Generate order
-            order = Order(name, random.randint(1, 10), date, product)
-
-            orders.append(order)
+            invoice.add_order(name, date, random.randint(1, 10), product)
+        invoice.date = date
         # Sort orders by date
-        orders.sort(key=lambda x: x.order_date)
+        invoice.orders = invoice.orders_by_date()
         # Add invoice to list
-        invoice_objects.append(Invoice(name, date, orders))
+        invoice_objects.append(invoice)
     return invoice_objects
 
 
@@ -98,9 +139,8 @@ def save_invoice_objects(objs, filename):
         objs (list): list of invoice objects
         filename (str): file name representing file to save objects to
     """
-    with open(filename, "wb") as outp:  # Overwrites any existing file.
-        for obj in objs:
-            pickle.dump(obj, outp, pickle.HIGHEST_PROTOCOL)
+    # Overwrites any existing file.
+    write_invoices(filename, objs)
 
 
 def load_invoice_objects(filename):
@@ -112,14 +152,8 @@ def load_invoice_objects(filename):
     Returns:
         list: invoice objects
     """
-    with open(filename, "rb") as inp:
-        objs = []
-        while True:
-            try:
-                objs.append(pickle.load(inp))
-            except EOFError:
-                break
-    return objs
+    with InvoiceStore(filename) as store:
+        return list(store)
 
 
 def invoice_to_pdf(invoice_object):
@@ -128,18 +162,17 @@ def invoice_to_pdf(invoice_object):
     generate.invoice_to_pdf()
 
 
-def generate_invoice_pdf_files(invoice_objects):
+def generate_invoice_pdf_files(invoice_objects, compiled=False):
     """Generate invoices"""
     for invoice in invoice_objects:
-        generate = PdfInvoice(invoice)
+        generate = PdfInvoice(invoice, compiled=compiled)
         generate.invoice_to_pdf()
 
 
 def generate_invoice_pdf_files_multithread(invoice_objects):
     """Generate invoices using multiprocessing"""
-    with Pool(processes=os.cpu_count()) as pool:
-        pool.map(invoice_to_pdf, invoice_objects)
-        pool.close()
+    renderer = BatchRenderer(processes=os.cpu_count(), chunksize=1)
+    return renderer.run(invoice_objects)
 
 
 # Test class for generating invoices
@@ -157,8 +190,8 @@ class TestGenerator(unittest.TestCase):
         self.validation_invoices = []
         # Get todays date as dd/mm/yyyy
         today = datetime.date.today().strftime("%d_%m_%Y")
-        # Invoices pkl filename
-        self.filename = f"invoices/{num_invoices}_invoices_{today}.pkl"
+        # Invoices store filename
+        self.filename = f"invoices/{num_invoices}_invoices_{today}.store"
 
     def tearDown(self) -> None:
         # t = time.time() - self.start
@@ -168,7 +201,7 @@ class TestGenerator(unittest.TestCase):
 
     def test_invoices_generated(self):
         """Initialize test class"""
-        # If invoices pkl file doesn't exist
+        # If invoices store file doesn't exist
         if not os.path.exists(self.filename):
             # Save generated objects to file
             save_invoice_objects(self.invoices, self.filename)
@@ -196,9 +229,1028 @@ class TestGenerator(unittest.TestCase):
     def test_generate_invoice_pdf_files_multithread(self):
         """Generate invoices using multiprocessing"""
         # Generate invoices
-        generate_invoice_pdf_files_multithread(self.invoices)
+        failures = generate_invoice_pdf_files_multithread(self.invoices)
+        self.assertEqual(failures, [])
+        num_pdfs = len([f for f in os.listdir("invoices") if f.endswith(".pdf")])
+        self.assertEqual(len(self.invoices), num_pdfs)
+
+    def test_generate_invoice_pdf_files_compiled(self):
+        """Generate invoices on a compiled page template"""
+        # Earlier tests may have compiled templates for other logos
+        invoice_pdf._templates.clear()
+        generate_invoice_pdf_files(self.invoices, compiled=True)
         num_pdfs = len([f for f in os.listdir("invoices") if f.endswith(".pdf")])
         self.assertEqual(len(self.invoices), num_pdfs)
+        # Every invoice is drawn on the same template
+        self.assertEqual(len(invoice_pdf._templates), 1)
+
+    @unittest.skipUnless(pymupdf, "needs PyMuPDF to rasterize pdfs")
+    def test_compiled_matches_classic(self):
+        """Compiled invoices rasterize exactly like classic ones"""
+        milk = Product("Milk", 1.25)
+        orders = [Order("Big Co", 2, datetime.date(2022, 5, 1), milk) for _ in range(40)]
+        paginated = Invoice("Big Co", datetime.date.today(), orders)
+        for invoice in (self.invoices[0], paginated):
+            classic, compiled = (
+                pymupdf.open("pdf", PdfInvoice(invoice, compiled=mode).render_to_bytes())
+                for mode in (False, True)
+            )
+            self.assertEqual(len(compiled), len(classic))
+            for classic_page, compiled_page in zip(classic, compiled):
+                self.assertEqual(
+                    compiled_page.get_pixmap(dpi=100).samples,
+                    classic_page.get_pixmap(dpi=100).samples,
+                )
+        self.assertGreater(len(classic), 1)
+
+    def test_incremental_render(self):
+        """Unchanged invoices are skipped on the next run"""
+        renderer = BatchRenderer(processes=1, incremental=True)
+        self.assertFalse(any(result.skipped for result in renderer.render(self.invoices)))
+        self.invoices[0].add_order(self.invoices[0].name, datetime.date.today(), 1, Product("Tea", 2.0))
+        skipped = [result.skipped for result in renderer.render(self.invoices)]
+        self.assertEqual(skipped, [False, True, True])
+        os.remove("invoices/.manifest.jsonl")
+
+    def test_invoice_document(self):
+        """Invoices share one document with a single copy of the logo"""
+        for compiled in (False, True):
+            documents = list(iter_documents(self.invoices, 2, compiled=compiled))
+            self.assertEqual([document.count for document in documents], [2, 1])
+            pdf = documents[0].pdf
+            self.assertEqual(pdf.page, 2)
+            self.assertEqual(len(pdf.images), 1)
+            documents[0].output("invoices/combined.pdf")
+            self.assertTrue(os.path.exists("invoices/combined.pdf"))
+
+    def test_long_invoice_pagination(self):
+        """Long invoices stream onto extra pages"""
+        milk = Product("Milk", 1.25)
+        for compiled in (False, True):
+            orders = (Order("Big Co", 2, datetime.date(2022, 5, 1), milk) for _ in range(100))
+            generate = PdfInvoice(Invoice("Big Co", datetime.date.today(), orders), compiled)
+            generate.render_to_bytes()
+            self.assertEqual(generate.pdf.page, 5)
+            self.assertIn("(\xa3250.00)", generate.pdf.pages[1])
+            self.assertIn("(Subtotal:)", generate.pdf.pages[1])
+            self.assertIn("(\xa3250.00)", generate.pdf.pages[5])
+
+    def test_short_invoice_one_page(self):
+        """The footer only moves to a page of its own when it does not fit"""
+        milk = Product("Milk", 1.25)
+        for compiled in (False, True):
+            pages = []
+            for count in (8, 9):
+                orders = [Order("Amy Jensen", 1, datetime.date(2022, 5, 1), milk)] * count
+                generate = PdfInvoice(Invoice("Amy Jensen", datetime.date.today(), orders), compiled)
+                generate.render_to_bytes()
+                pages.append(generate.pdf.page)
+            self.assertEqual(pages, [1, 2])
+
+    def test_render_to_bytes(self):
+        """Invoices render to bytes and file-like objects"""
+        data = PdfInvoice(self.invoices[0], compiled=True).render_to_bytes()
+        self.assertTrue(data.startswith(b"%PDF"))
+        buffer = io.BytesIO()
+        self.assertEqual(PdfInvoice(self.invoices[0]).render_to(buffer), len(buffer.getvalue()))
+        self.assertEqual([f for f in os.listdir("invoices") if f.endswith(".pdf")], [])
+
+    def test_async_renderer(self):
+        """Renders run concurrently on the renderer's executor"""
+
+        async def render_all():
+            async with AsyncRenderer(max_concurrency=2) as renderer:
+                return await asyncio.gather(*map(renderer.render, self.invoices))
+
+        results = asyncio.run(render_all())
+        self.assertEqual(len(results), len(self.invoices))
+        self.assertTrue(all(result.startswith(b"%PDF") for result in results))
+
+    def test_batch_renderer_failures(self):
+        """A bad invoice is reported without stopping the batch"""
+        bad = Invoice("Bad Invoice", datetime.date.today(), None)
+        renderer = BatchRenderer(processes=2, chunksize=1)
+        results = list(renderer.render(self.invoices + [bad]))
+        self.assertEqual(len(results), len(self.invoices) + 1)
+        failures = [result for result in results if not result.ok]
+        self.assertEqual([result.index for result in failures], [len(self.invoices)])
+        self.assertIn("TypeError", failures[0].error)
+        self.assertTrue(all(result.seconds > 0 for result in results))
+
+
+class TestImageCache(unittest.TestCase):
+    """Test the process-wide image cache"""
+
+    def test_image_parsed_once(self):
+        """Repeated lookups return the same parsed image"""
+        cache = ImageCache()
+        first = cache.get("images/table_bar.png")
+        self.assertIs(first, cache.get("images/table_bar.png"))
+
+    def test_register_image(self):
+        """Registered images are shared but not mutated by output"""
+        cache = ImageCache()
+        for _ in range(2):
+            pdf = FPDF()
+            pdf.add_page()
+            cache.register(pdf, "images/balance_bar.png")
+            pdf.image("images/balance_bar.png", 0, 0, 10, 10)
+            self.assertTrue(pdf.output(dest="S").startswith("%PDF"))
+        info, _ = cache.get("images/balance_bar.png")
+        self.assertIn("data", info)
+
+
+class TestLogoAsset(unittest.TestCase):
+    """Test the optimised logo pipeline"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, "logo.png")
+        self.target = os.path.join(self.folder, "main_logo.png")
+        self.write_logo((200, 30, 30, 255))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_logo(self, color):
+        img = Image.new("RGBA", (1000, 800), (0, 0, 0, 0))
+        img.paste(Image.new("RGBA", (500, 400), color), (250, 200))
+        img.save(self.source, pnginfo=None, dpi=(72, 72))
+
+    def test_build(self):
+        """The logo is downsampled, flattened and stripped"""
+        asset = LogoAsset(self.source, self.target, (30, 30), dpi=100)
+        self.assertTrue(asset.ensure())
+        img = Image.open(self.target)
+        self.assertEqual(img.mode, "P")
+        self.assertEqual(img.size, (118, 94))
+        self.assertNotIn("dpi", img.info)
+        self.assertEqual(img.convert("RGB").getpixel((0, 0)), (255, 255, 255))
+        self.assertEqual(img.convert("RGB").getpixel((59, 47)), (200, 30, 30))
+
+    def test_rebuild(self):
+        """The logo is only rebuilt when its source changes"""
+        asset = LogoAsset(self.source, self.target, (30, 30), dpi=100)
+        self.assertTrue(asset.ensure())
+        self.assertFalse(asset.ensure())
+        # A touched but identical source is hashed, not rebuilt
+        os.utime(self.source, ns=(0, 0))
+        self.assertFalse(asset.ensure())
+        self.assertFalse(LogoAsset(self.source, self.target, (30, 30), dpi=100).ensure())
+        self.assertTrue(LogoAsset(self.source, self.target, (30, 30), dpi=200).ensure())
+        self.write_logo((30, 30, 200, 255))
+        self.assertTrue(asset.ensure())
+        img = Image.open(self.target).convert("RGB")
+        self.assertEqual(img.getpixel((59, 47)), (30, 30, 200))
+
+
+class TestBrandingConfig(unittest.TestCase):
+    """Test branding config loading"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        with open(os.path.join(self.folder, "notes.txt"), "w") as f:
+            f.write("First notes")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_defaults(self):
+        """Missing files fall back to placeholder text"""
+        branding = BrandingConfig(self.folder, self.folder)
+        self.assertEqual(branding.address, "Address")
+        self.assertEqual(branding.notes, "First notes")
+        self.assertFalse(branding.has_main_logo())
+
+    def test_refresh(self):
+        """Changed files are only re-read when asked"""
+        branding = BrandingConfig(self.folder, self.folder)
+        path = os.path.join(self.folder, "notes.txt")
+        with open(path, "w") as f:
+            f.write("Second notes")
+        os.utime(path, ns=(0, 0))
+        self.assertFalse(branding.refresh())
+        self.assertEqual(branding.notes, "First notes")
+        self.assertTrue(branding.refresh(force=True))
+        self.assertEqual(branding.notes, "Second notes")
+
+
+class TestProfiler(unittest.TestCase):
+    """Test rendering instrumentation"""
+
+    def tearDown(self):
+        profiler.enable(False)
+        profiler.reset()
+
+    def test_disabled(self):
+        """Disabled profilers record nothing"""
+        PdfInvoice(get_invoice_objects(1)[0]).render_to_bytes()
+        self.assertEqual(profiler.snapshot(), {})
+
+    def test_batch_spans(self):
+        """Spans from pool workers are merged into one histogram per section"""
+        profiler.enable()
+        folder = tempfile.mkdtemp()
+        try:
+            BatchRenderer(processes=2, chunksize=1, folder=folder).run(get_invoice_objects(3))
+        finally:
+            shutil.rmtree(folder)
+        spans = profiler.snapshot()
+        for name in ("template", "items", "total", "footer", "output"):
+            self.assertEqual(spans[name]["count"], 3, name)
+        text = profiler.to_prometheus()
+        self.assertIn('invoice_render_span_seconds_count{span="items"} 3', text)
+        self.assertIn('le="+Inf"', text)
+        self.assertEqual(json.loads(profiler.to_json())["spans"]["items"]["count"], 3)
+
+
+class TestInvoiceStore(unittest.TestCase):
+    """Test the random-access invoice store"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "invoices.store")
+        self.invoices = get_invoice_objects(10)
+        write_invoices(self.path, self.invoices)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_random_access(self):
+        """Invoices are read back individually, by slice and in order"""
+        with InvoiceStore(self.path) as store:
+            self.assertEqual(len(store), 10)
+            self.assertEqual(store[7], self.invoices[7])
+            self.assertEqual(store[-1], self.invoices[-1])
+            self.assertEqual(store[2:5], self.invoices[2:5])
+            self.assertEqual(list(store), self.invoices)
+            with self.assertRaises(IndexError):
+                store[10]
+
+    def test_shards(self):
+        """Shards cover the store and can be iterated independently"""
+        with InvoiceStore(self.path) as store:
+            shards = store.shards(3)
+        self.assertEqual([len(shard) for shard in shards], [4, 3, 3])
+        invoices = [invoice for shard in shards for invoice in pickle.loads(pickle.dumps(shard))]
+        self.assertEqual(invoices, self.invoices)
+
+    def test_incomplete_store(self):
+        """Truncated stores are rejected"""
+        with open(self.path, "r+b") as f:
+            f.truncate(100)
+        with self.assertRaises(ValueError):
+            InvoiceStore(self.path)
+
+
+class TestInvoiceIndex(unittest.TestCase):
+    """Test the aggregates an invoice keeps as orders are added"""
+
+    def setUp(self):
+        self.milk = Product("Milk", 1.25)
+        self.eggs = Product("Eggs", 2.1)
+        self.invoice = Invoice("Amy Jensen", datetime.date(2022, 5, 31), [])
+        for day, quantity, product in ((3, 2, self.milk), (1, 1.5, self.eggs), (3, 1, self.eggs)):
+            self.invoice.add_order("Amy Jensen", datetime.date(2022, 5, day), quantity, product)
+
+    def test_aggregates(self):
+        """Totals, subtotals and the date order follow add_order"""
+        self.assertEqual(self.invoice.total_pence(), 250 + 315 + 210)
+        self.assertEqual(self.invoice.total(), Decimal("7.75"))
+        self.assertEqual(self.invoice.totals_by_product(), {"Milk": (2000, 250), "Eggs": (2500, 525)})
+        self.assertEqual(self.invoice.totals_by_day(), {
+            datetime.date(2022, 5, 1): 315,
+            datetime.date(2022, 5, 3): 460,
+        })
+        by_date = self.invoice.orders_by_date()
+        self.assertEqual([order.quantity for order in by_date], [1.5, 2, 1])
+        self.invoice.add_order("Amy Jensen", datetime.date(2022, 5, 2), 4, self.milk)
+        self.assertEqual(self.invoice.total_pence(), 775 + 500)
+        between = self.invoice.orders_between(datetime.date(2022, 5, 2), datetime.date(2022, 5, 3))
+        self.assertEqual([order.quantity for order in between], [4, 2, 1])
+        # Orders appended directly are picked up, and a new list replaces them
+        self.invoice.orders.append(Order("Amy Jensen", 1, datetime.date(2022, 5, 9), self.eggs))
+        self.assertEqual(self.invoice.total_pence(), 1275 + 210)
+        self.invoice.orders = self.invoice.orders[:1]
+        self.assertEqual(self.invoice.total_pence(), 250)
+
+    def test_equality(self):
+        """Invoices compare by digest, including after pickling"""
+        copy = pickle.loads(pickle.dumps(self.invoice))
+        self.assertNotIn("index", pickle.dumps(self.invoice).decode("latin1"))
+        self.assertEqual(copy, self.invoice)
+        self.assertEqual(copy.digest(), self.invoice.digest())
+        table = Invoice(self.invoice.name, self.invoice.date, OrderTable("Amy Jensen", self.invoice.orders))
+        self.assertEqual(table, self.invoice)
+        copy.add_order("Amy Jensen", datetime.date(2022, 5, 4), 1, self.milk)
+        self.assertNotEqual(copy, self.invoice)
+        reordered = Invoice(self.invoice.name, self.invoice.date, self.invoice.orders_by_date())
+        self.assertNotEqual(reordered, self.invoice)
+        stream = Invoice(self.invoice.name, self.invoice.date, iter(self.invoice.orders))
+        self.assertIsNone(stream.order_index())
+        # Numbers compare as Order.__eq__ compares them
+        date = datetime.date(2022, 5, 31)
+        invoices = [
+            Invoice("Amy Jensen", date, [Order("Amy Jensen", quantity, date, Product("Milk", price))])
+            for quantity, price in ((2, Decimal("1.10")), (2.0, Decimal("1.1")), (2, 1.1))
+        ]
+        for other in invoices[1:]:
+            self.assertEqual(invoices[0] == other, invoices[0].orders == other.orders)
+        self.assertEqual(invoices[0], invoices[1])
+        self.assertNotEqual(invoices[0], invoices[2])
+
+    def test_in_place_changes(self):
+        """Changing the orders in place is noticed, and orders are immutable"""
+        copy = pickle.loads(pickle.dumps(self.invoice))
+        self.assertEqual(copy, self.invoice)
+        extra = Order("Amy Jensen", 3, datetime.date(2022, 5, 2), self.milk)
+        copy.orders[0] = extra
+        self.assertNotEqual(copy, self.invoice)
+        self.assertEqual(copy.total_pence(), 375 + 315 + 210)
+        copy.orders[0] = self.invoice.orders[0]
+        self.assertEqual(copy, self.invoice)
+        # Same length and total, different orders
+        copy.orders.append(copy.orders.pop(0))
+        self.assertNotEqual(copy, self.invoice)
+        self.assertNotEqual(copy.digest(), self.invoice.digest())
+        copy.orders.sort(key=lambda order: order.order_date)
+        self.assertEqual([order.quantity for order in copy.orders_by_date()], [1.5, 1, 2])
+        self.assertEqual(copy.totals_by_day(), self.invoice.totals_by_day())
+        del copy.orders[:]
+        self.assertEqual(copy.total_pence(), 0)
+        # The invoice keeps the caller's list
+        orders = []
+        invoice = Invoice("Amy Jensen", datetime.date(2022, 5, 31), orders)
+        self.assertEqual(invoice.total_pence(), 0)
+        orders.append(extra)
+        self.assertIs(invoice.orders, orders)
+        self.assertEqual(invoice.total_pence(), 375)
+        with self.assertRaises(AttributeError):
+            self.invoice.orders[0].quantity = 10
+        with self.assertRaises(AttributeError):
+            self.milk.price = 2
+        self.assertEqual(self.invoice.total_pence(), 775)
+
+
+class TestOrderTable(unittest.TestCase):
+    """Test columnar order storage"""
+
+    def setUp(self):
+        self.invoice = get_invoice_objects(1)[0]
+        self.table = OrderTable(self.invoice.name, self.invoice.orders)
+
+    def test_round_trip(self):
+        """A table yields the orders it was built from"""
+        self.assertEqual(len(self.table), len(self.invoice.orders))
+        self.assertEqual(self.table, self.invoice.orders)
+        self.assertEqual(self.table, OrderTable(self.invoice.name, self.table))
+        invoice = Invoice(self.invoice.name, self.invoice.date, self.table)
+        self.assertTrue(PdfInvoice(invoice).render_to_bytes().startswith(b"%PDF"))
+
+    def test_exact_totals(self):
+        """Line costs and totals are exact in pence"""
+        table = OrderTable("Amy Jensen")
+        table.add_order("Amy Jensen", datetime.date(2022, 5, 31), 3, Product("Milk", 1.1))
+        table.add_order("Amy Jensen", datetime.date(2022, 5, 31), 0.5, Product("Eggs", 1.25))
+        self.assertEqual(list(table.line_costs()), [330, 63])
+        self.assertEqual(table.total(), Decimal("3.93"))
+        self.assertEqual([order.quantity for order in table], [3, 0.5])
+
+    def test_half_penny(self):
+        """Lists and tables of orders round half pennies the same way"""
+        eggs = Product("Eggs", 1.25)
+        orders = [Order("Amy Jensen", 0.5, datetime.date(2022, 5, 31), eggs)]
+        self.assertEqual(orders[0].cost, 0.63)
+        date = datetime.date(2022, 5, 31)
+        listed = Invoice("Amy Jensen", date, orders)
+        tabled = Invoice("Amy Jensen", date, OrderTable("Amy Jensen", orders))
+        self.assertEqual(listed, tabled)
+        self.assertEqual(listed.total_pence(), tabled.orders.total_pence())
+        totals = [Ledger.from_invoices([invoice]).total() for invoice in (listed, tabled)]
+        self.assertEqual(totals, [63, 63])
+
+    def test_weighed_quantity(self):
+        """Quantities to 3dp are kept exactly, and finer ones are refused"""
+        date = datetime.date(2022, 5, 31)
+        cheese = Product("Cheese", 3)
+        orders = [Order("Amy Jensen", 0.333, date, cheese)]
+        self.assertEqual(orders[0].cost, 1.0)
+        table = OrderTable("Amy Jensen", orders)
+        self.assertEqual([(order.quantity, order.cost) for order in table], [(0.333, 1.0)])
+        listed = Invoice("Amy Jensen", date, orders)
+        tabled = Invoice("Amy Jensen", date, table)
+        self.assertEqual(listed, tabled)
+        ledgers = [Ledger.from_invoices([invoice]) for invoice in (listed, tabled)]
+        self.assertEqual([ledger.total() for ledger in ledgers], [100, 100])
+        self.assertEqual([ledger.totals_by_product() for ledger in ledgers], [{"Cheese": (333, 100)}] * 2)
+        with self.assertRaises(ValueError):
+            table.add_order("Amy Jensen", date, 0.3333, cheese)
+        with self.assertRaises(ValueError):
+            table.add_order("Amy Jensen", date, 1, Product("Milk", 1.205))
+        self.assertEqual(len(table), 1)
+        self.assertEqual(len(table.products), 1)
+
+
+class TestLedger(unittest.TestCase):
+    """Test the columnar ledger of a batch of invoices"""
+
+    def setUp(self):
+        self.invoices = get_invoice_objects(20)
+
+    def test_grouped_totals(self):
+        """Grouped totals match summing the orders one by one"""
+        ledger = Ledger.from_invoices(self.invoices)
+        customers = {}
+        days = {}
+        for invoice in self.invoices:
+            for order in invoice.orders:
+                pence = round(order.cost * 100)
+                customers[invoice.name] = customers.get(invoice.name, 0) + pence
+                days[order.order_date] = days.get(order.order_date, 0) + pence
+        self.assertEqual(len(ledger), sum(len(invoice.orders) for invoice in self.invoices))
+        self.assertEqual(ledger.totals_by_customer(), customers)
+        self.assertEqual(ledger.totals_by_day(), days)
+        self.assertEqual(ledger.total(), sum(customers.values()))
+        products = ledger.totals_by_product()
+        self.assertEqual(sum(cost for _, cost in products.values()), ledger.total())
+
+    def test_order_tables(self):
+        """Invoices holding order tables give the same ledger"""
+        tables = [
+            Invoice(invoice.name, invoice.date, OrderTable(invoice.name, invoice.orders))
+            for invoice in self.invoices
+        ]
+        expected = Ledger.from_invoices(self.invoices)
+        ledger = Ledger.from_invoices(tables)
+        self.assertEqual(ledger.totals_by_customer(), expected.totals_by_customer())
+        self.assertEqual(ledger.totals_by_product(), expected.totals_by_product())
+
+    def test_reports(self):
+        """Reports are written as CSV"""
+        ledger = Ledger.from_invoices(self.invoices)
+        lines = io.StringIO()
+        ledger.write_lines(lines)
+        rows = list(csv.reader(io.StringIO(lines.getvalue())))
+        self.assertEqual(len(rows), len(ledger) + 1)
+        summary = io.StringIO()
+        ledger.write_summary(summary)
+        rows = list(csv.reader(io.StringIO(summary.getvalue())))
+        self.assertEqual(rows[-1][0], "total")
+        self.assertEqual(rows[-1][3], f"{ledger.total() / 100:.2f}")
+
+
+class TestDrawing(unittest.TestCase):
+    """Test drawing helpers that skip redundant state changes"""
+
+    def setUp(self):
+        self.pdf = FPDF("P", "mm", (216.04, 279.39))
+        self.pdf.add_page()
+        self.pdf.set_font("helvetica", "B", 10.0)
+        self.pdf.set_font("helvetica", "", 10.0)
+
+    def content(self):
+        return self.pdf.pages[self.pdf.page]
+
+    def test_draw_color(self):
+        """An unchanged draw colour is not written again"""
+        start = len(self.content())
+        set_draw_color(self.pdf, 95, 95, 95)
+        set_draw_color(self.pdf, 95, 95, 95)
+        self.assertEqual(self.content()[start:].count("RG"), 1)
+        set_draw_color(self.pdf, 0, 0, 0)
+        set_draw_color(self.pdf, 0)
+        self.assertEqual(self.content()[start:].count(" G"), 1)
+
+    def test_text_row(self):
+        """A row of cells is one text object placed where cell places it"""
+        self.pdf.set_text_color(65, 65, 65)
+        self.pdf.set_font("helvetica", "B", 10.0)
+        start = len(self.content())
+        write_text(self.pdf, ((15.1, 107, "B", "Milk"), (129, 107, "", "2")))
+        block = self.content()[start:]
+        self.assertEqual(block.count("BT"), 1)
+        self.assertEqual(block.count("Tf"), 1)
+        self.assertEqual(block.count(self.pdf.text_color), 1)
+        self.pdf.set_font("helvetica", "", 10.0)
+        start = len(self.content())
+        self.pdf.set_xy(129, 107)
+        self.pdf.cell(ln=0, h=0, align="L", w=85, txt="2", border=0)
+        position = self.content()[start:].split("BT ")[1].split(" Td")[0]
+        first, second = block.split(" Td")[:2]
+        x = float(first.split()[-2]) + float(second.split()[-2])
+        y = float(first.split()[-1]) + float(second.split()[-1])
+        self.assertEqual(f"{x:.2f} {y:.2f}", position)
+        self.assertEqual(self.pdf.x, 129 + 85)
+
+    def test_bar_state(self):
+        """Bars leave the fill and text colours of the document as they were"""
+        fill_color, color_flag = self.pdf.fill_color, self.pdf.color_flag
+        start = len(self.content())
+        fill_rounded_rect(self.pdf, 10.5, 93.75, 195, 7.6, 1.0, (58, 58, 58))
+        block = self.content()[start:].strip()
+        self.assertTrue(block.startswith("q 0.2275 g ") and block.endswith(" f Q"))
+        self.assertEqual((self.pdf.fill_color, self.pdf.color_flag), (fill_color, color_flag))
+
+    @unittest.skipUnless(pymupdf, "needs PyMuPDF to rasterize pdfs")
+    def test_bars_match_images(self):
+        """Vector bars rasterize like the bar images they replace"""
+        balance = invoice_pdf.BALANCE_BAR
+        x, w, h = invoice_pdf.TABLE_BAR
+        bars = (
+            ("images/balance_bar.png", balance, "balance_bar"),
+            ("images/table_bar.png", (x, invoice_pdf.TABLE_TOP, w, h), "table_bar"),
+        )
+        for image, (x, y, w, h), color in bars:
+            area = (x - 2, y - 2, x + w + 2, y + h + 2)
+            reference = self.rasterize(lambda pdf: pdf.image(image, x, y, w, h), area)
+            color = BrandingConfig().theme[color]
+            rect = self.rasterize(
+                lambda pdf: fill_rounded_rect(pdf, x, y, w, h, invoice_pdf.BAR_RADIUS, color), area
+            )
+            self.assertEqual(rect.size, reference.size)
+            width = rect.width
+            pixels = reference.samples
+            for i, (a, b) in enumerate(zip(pixels, rect.samples)):
+                if abs(a - b) <= 2:
+                    continue
+                # Only anti-aliasing along the outline may differ
+                row, column = divmod(i, width)
+                around = {
+                    pixels[(row + dy) * width + column + dx]
+                    for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                }
+                self.assertGreater(len(around), 1, f"{image} differs at pixel {column}, {row}")
+
+    def rasterize(self, draw, area, dpi=400):
+        """Draw on a new page and rasterize an area of it, given in mm"""
+        pdf = FPDF("P", "mm", (216.04, 279.39))
+        pdf.add_page()
+        draw(pdf)
+        document = pymupdf.open("pdf", pdf.output(dest="S").encode("latin1"))
+        clip = pymupdf.Rect(*(v * pdf.k for v in area))
+        return document[0].get_pixmap(dpi=dpi, clip=clip, colorspace=pymupdf.csGRAY)
+
+
+class TestJobQueue(unittest.TestCase):
+    """Test the crash-resumable render queue"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "queue.db")
+        self.invoices = get_invoice_objects(3)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lease_ack_retry(self):
+        """Leased jobs are acknowledged or retried after a backoff"""
+        with job_queue.JobQueue(self.path, max_attempts=2, backoff=60) as queue:
+            self.assertEqual(queue.add(self.invoices), 3)
+            first = queue.lease("a:1", 2)
+            self.assertEqual([job_id for job_id, _ in first], [1, 2])
+            self.assertEqual(first[0][1], self.invoices[0])
+            self.assertEqual([job_id for job_id, _ in queue.lease("b:1", 2)], [3])
+            self.assertTrue(queue.ack(1, "a:1", "one.pdf"))
+            self.assertFalse(queue.ack(3, "a:1", "three.pdf"))
+            self.assertTrue(queue.fail(2, "a:1", "error"))
+            # Job 2 waits for its backoff
+            self.assertEqual(queue.lease("a:1", 2), [])
+            self.assertEqual(queue.counts(), {"pending": 1, "leased": 1, "done": 1, "failed": 0})
+
+    def test_expired_lease(self):
+        """A job whose lease expired is handed to another worker"""
+        with job_queue.JobQueue(self.path, lease_seconds=0, max_attempts=2, backoff=0) as queue:
+            queue.add(self.invoices[:1])
+            queue.lease("a:1")
+            self.assertEqual(len(queue.lease("b:1")), 1)
+            self.assertFalse(queue.ack(1, "a:1", "one.pdf"))
+            # Both leases counted as attempts
+            self.assertTrue(queue.fail(1, "b:1", "error"))
+            self.assertEqual(queue.failures(), [(1, self.invoices[0].name, "error")])
+
+    def test_expired_lease_attempts(self):
+        """A job whose leases keep expiring backs off, then fails"""
+        with job_queue.JobQueue(self.path, lease_seconds=0, max_attempts=2, backoff=60) as queue:
+            queue.add(self.invoices[:1])
+            queue.lease("a:1")
+            # The expired lease waits for its backoff like a failed attempt
+            self.assertEqual(queue.lease("b:1"), [])
+            self.assertEqual(queue.counts()["pending"], 1)
+            queue.db.execute("UPDATE jobs SET available_at = 0")
+            self.assertEqual(len(queue.lease("b:1")), 1)
+            self.assertEqual(queue.lease("c:1"), [])
+            self.assertEqual(queue.counts(), {"pending": 0, "leased": 0, "done": 0, "failed": 1})
+            self.assertEqual(queue.failures()[0][:2], (1, self.invoices[0].name))
+
+    def test_recover(self):
+        """Leases of dead workers on this host are released"""
+        with job_queue.JobQueue(self.path, max_attempts=2, backoff=60) as queue:
+            queue.add(self.invoices[:2])
+            queue.lease(job_queue.worker_name())
+            queue.lease("localhost-test:999999999")
+            self.assertEqual(queue.recover("localhost-test"), 1)
+            self.assertEqual(queue.counts()["leased"], 1)
+            # The released job waits for its backoff, then fails with its worker again
+            self.assertEqual(queue.lease("a:1"), [])
+            queue.db.execute("UPDATE jobs SET available_at = 0 WHERE state = ?", (job_queue.PENDING,))
+            self.assertEqual(len(queue.lease("localhost-test:999999999")), 1)
+            self.assertEqual(queue.recover("localhost-test"), 1)
+            self.assertEqual(queue.counts()["failed"], 1)
+
+    def test_resume(self):
+        """A resumed run only renders what is left, and failures are kept"""
+        output = os.path.join(self.folder, "invoices")
+        bad = Invoice("Bad Invoice", datetime.date.today(), None)
+        with job_queue.JobQueue(self.path, backoff=0) as queue:
+            queue.add(self.invoices + [bad])
+            # A worker that died after leasing two jobs
+            queue.lease("localhost-test:999999999", 2)
+            queue.recover("localhost-test")
+        options = {"max_attempts": 2, "backoff": 0}
+        job_queue.work(self.path, folder=output, queue_options=options)
+        with job_queue.JobQueue(self.path) as queue:
+            self.assertEqual(queue.counts()["done"], 3)
+            self.assertEqual(queue.failures()[0][:2], (4, "Bad Invoice"))
+        self.assertEqual(len(os.listdir(output)), 3)
+        self.assertEqual(job_queue.work(self.path, folder=output), 0)
+
+
+class TestOutputSink(unittest.TestCase):
+    """Test where rendered pdfs are written"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.invoices = get_invoice_objects(3)
+        # A different customer with the same name
+        twin = get_invoice_objects(1)[0]
+        twin.name = self.invoices[0].name
+        self.invoices.append(twin)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_folder_sink(self):
+        """Sharded, unique file names keep every invoice"""
+        sink = FolderSink(self.folder, shards=2, unique=True, sync_batch=3)
+        results = list(BatchRenderer(processes=2, chunksize=1, sink=sink).render(self.invoices))
+        files = list(sink.files())
+        self.assertEqual(len(files), 4)
+        self.assertEqual(sorted(files), sorted(result.filename for result in results))
+        for filename in files:
+            self.assertEqual(len(os.path.relpath(filename, self.folder).split(os.sep)), 3)
+            with open(filename, "rb") as f:
+                self.assertTrue(f.read().startswith(b"%PDF"))
+
+    def test_worker_sync(self):
+        """Workers fsync the files they wrote when they exit"""
+        log = os.path.join(tempfile.mkdtemp(), "fsync.log")
+        self.addCleanup(shutil.rmtree, os.path.dirname(log))
+
+        def fsync_path(path, flags):
+            # Forked workers share the log, each line written in one call
+            with open(log, "a") as f:
+                f.write(f"{os.getpid()} {path}\n")
+
+        # More files than the batch, so only the exit flush syncs them
+        sink = FolderSink(self.folder, sync_batch=10)
+        with unittest.mock.patch("output_sink.fsync_path", fsync_path):
+            BatchRenderer(processes=2, chunksize=1, sink=sink).run(self.invoices)
+        with open(log) as f:
+            synced = [line.rstrip("\n").split(" ", 1) for line in f]
+        self.assertTrue(all(int(pid) != os.getpid() for pid, _ in synced))
+        paths = {path for _, path in synced}
+        self.assertTrue(set(sink.files()) <= paths)
+        self.assertIn(self.folder, paths)
+
+    def test_flat_folder_sink(self):
+        """Without unique names, invoices of the same customer collide"""
+        sink = FolderSink(self.folder)
+        BatchRenderer(processes=1, sink=sink).run(self.invoices)
+        self.assertEqual(len(os.listdir(self.folder)), 3)
+
+    def test_archive_sink(self):
+        """A batch is streamed into one archive"""
+        for name, processes in (("batch.zip", 2), ("batch.tar", 1)):
+            path = os.path.join(self.folder, name)
+            renderer = BatchRenderer(processes=processes, chunksize=1, sink=ArchiveSink(path))
+            self.assertEqual(renderer.run(self.invoices), [])
+            if name.endswith(".zip"):
+                with zipfile.ZipFile(path) as archive:
+                    pdfs = [archive.read(member) for member in archive.namelist()]
+            else:
+                with tarfile.open(path) as archive:
+                    pdfs = [archive.extractfile(member).read() for member in archive.getmembers()]
+            self.assertEqual(len(pdfs), 4)
+            self.assertTrue(all(pdf.startswith(b"%PDF") for pdf in pdfs))
+        self.assertEqual(sorted(os.listdir(self.folder)), ["batch.tar", "batch.zip"])
+
+
+class TestIngest(unittest.TestCase):
+    """Test streaming invoice ingestion"""
+
+    rows = [
+        ("Amy Jensen", "2022-05-31", "2022-05-20", "Milk", "1.20", "2"),
+        ("Randy Roberts", "2022-05-31", "2022-05-21", "Eggs", "2.50", "1.5"),
+        ("Amy Jensen", "2022-05-31", "2022-05-22", "Bread", "1.10", "1"),
+        ("Amy Jensen", "2022-06-30", "2022-06-01", "Milk", "1.20", "3"),
+        ("Randy Roberts", "2022-05-31", "2022-05-23", "Eggs", "2.50", "4"),
+    ]
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_csv(self, rows):
+        path = os.path.join(self.folder, "orders.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(ingest.FIELDS)
+            writer.writerows(rows)
+        return path
+
+    def test_external_sort(self):
+        """Ungrouped lines are sorted on disk into one invoice per key"""
+        path = self.write_csv(self.rows)
+        invoices = list(ingest.iter_invoices(path, chunk_size=2))
+        keys = [(invoice.name, str(invoice.date)) for invoice in invoices]
+        self.assertEqual(keys, [
+            ("Amy Jensen", "2022-05-31"),
+            ("Amy Jensen", "2022-06-30"),
+            ("Randy Roberts", "2022-05-31"),
+        ])
+        self.assertEqual([order.product.name for order in invoices[0].orders], ["Milk", "Bread"])
+        self.assertEqual([order.quantity for order in invoices[2].orders], [1.5, 4])
+        # Repeated products share one Product object
+        self.assertIs(invoices[2].orders[0].product, invoices[2].orders[1].product)
+
+    def test_bounded_fan_in(self):
+        """Many sorted runs are merged in passes, a few files at a time"""
+        rows = [(f"Customer {i % 7}", "2022-05-31", f"2022-05-{1 + i % 28:02d}", "Milk", "1.20", str(i))
+                for i in range(60)]
+        path = self.write_csv(rows)
+        opened = []
+        most_open = [0]
+        real_open = open
+
+        def tracking_open(file, *args, **kwargs):
+            f = real_open(file, *args, **kwargs)
+            opened.append(f)
+            most_open[0] = max(most_open[0], sum(not f.closed for f in opened))
+            return f
+
+        with unittest.mock.patch("builtins.open", tracking_open):
+            # 60 lines in runs of 2 make 30 runs, merged 3 at a time
+            invoices = list(ingest.iter_invoices(path, chunk_size=2, fan_in=3))
+        # Three runs and the merged run they are written to
+        self.assertEqual(most_open[0], 4)
+        self.assertEqual([invoice.name for invoice in invoices], [f"Customer {i}" for i in range(7)])
+        # Lines keep their export order within each invoice
+        quantities = [order.quantity for order in invoices[0].orders]
+        self.assertEqual(quantities, sorted(quantities))
+        self.assertEqual(sum(len(invoice.orders) for invoice in invoices), 60)
+
+    def test_grouped_jsonl(self):
+        """Pre-grouped JSONL is streamed without sorting"""
+        path = os.path.join(self.folder, "orders.jsonl")
+        with open(path, "w") as f:
+            for row in sorted(self.rows, key=lambda row: row[:2]):
+                f.write(json.dumps(dict(zip(ingest.FIELDS, row))) + "\n")
+        invoices = ingest.iter_invoices(path, grouped=True)
+        self.assertEqual(next(invoices).orders[1].cost, 1.1)
+        self.assertEqual(len(list(invoices)), 2)
+
+
+class TestLoadGenerator(unittest.TestCase):
+    """Test synthetic invoice generation"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_reproducible(self):
+        """The same seed gives the same stream, and any invoice on its own"""
+        names = ["Amy Jensen", "Randy Roberts"]
+        options = {"names": names, "lines": long_tail(20), "fractional": 0.5}
+        generator = InvoiceGenerator(seed=3, **options)
+        invoices = list(generator.invoices(5))
+        self.assertEqual(list(InvoiceGenerator(seed=3, **options).invoices(5)), invoices)
+        self.assertEqual(generator.invoice(4), invoices[4])
+        self.assertNotEqual(InvoiceGenerator(seed=4, names=names).invoice(0), invoices[0])
+        # More invoices than names are invoiced a period later
+        self.assertEqual([invoice.name for invoice in invoices[:3]], names + names[:1])
+        self.assertEqual((invoices[2].date - invoices[0].date).days, 30)
+        orders = [order for invoice in invoices for order in invoice.orders]
+        self.assertTrue(any(isinstance(order.quantity, float) for order in orders))
+        for invoice in invoices:
+            dates = [order.order_date for order in invoice.orders]
+            self.assertEqual(dates, sorted(dates))
+
+    def test_write_export(self):
+        """Generated exports ingest back into the same invoices"""
+        generator = InvoiceGenerator(seed=1, fractional=0.3, skew=1.0)
+        invoices = list(generator.invoices(20))
+        for name in ("orders.csv", "orders.jsonl"):
+            path = os.path.join(self.folder, name)
+            self.assertEqual(load_generator.write(path, generator.invoices(20)), 20)
+            self.assertEqual(list(ingest.iter_invoices(path, grouped=True)), invoices)
+        path = os.path.join(self.folder, "invoices.store")
+        load_generator.write(path, generator.invoices(20))
+        with InvoiceStore(path) as store:
+            self.assertEqual(store[19], invoices[19])
+
+    def test_render_fractional(self):
+        """Any fractional quantity renders, to at most 2dp"""
+        invoices = list(InvoiceGenerator(seed=1, fractional=0.5).invoices(10))
+        quantities = [order.quantity for invoice in invoices for order in invoice.orders]
+        self.assertTrue(any(quantity % 1 not in (0, 0.25, 0.5) for quantity in quantities))
+        for compiled in (False, True):
+            for invoice in invoices:
+                data = PdfInvoice(invoice, compiled=compiled).render_to_bytes()
+                self.assertTrue(data.startswith(b"%PDF"))
+        milk = Product("Milk", 1.2)
+        orders = [Order("Amy Jensen", quantity, datetime.date(2022, 5, 20), milk)
+                  for quantity in (2, 0.5, 1.25, 0.75, 3.1)]
+        invoice = Invoice("Amy Jensen", datetime.date(2022, 5, 31), orders)
+        with unittest.mock.patch("invoice_pdf.write_text", wraps=write_text) as spy:
+            PdfInvoice(invoice).render_to_bytes()
+        texts = [text for call in spy.call_args_list for _, _, _, text in call.args[1]]
+        for quantity in ("2", "0.5", "1.25", "0.75", "3.1"):
+            self.assertIn(quantity, texts)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Smoke test the benchmark suite"""
+
+    def test_results_written(self):
+        """Benchmarks write machine-readable results"""
+        folder = tempfile.mkdtemp()
+        try:
+            output = os.path.join(folder, "bench.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                benchmark.main(["--invoices", "3", "--processes", "1", "--lines", "1", "30", "--output", output])
+            with open(output, "r") as f:
+                results = json.load(f)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual([result["lines"] for result in results["line_counts"]], [1, 30])
+        self.assertEqual(results["pool"][0]["failures"], 0)
+        self.assertIn("p99", results["sequential"][0]["latency_ms"])
+
+
+class LogoHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in logo host that supports ETag revalidation"""
+
+    body = b"logo"
+    requests = []
+
+    def do_GET(self):
+        LogoHandler.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLogoManager(unittest.TestCase):
+    """Test logo downloads against a local server"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), LogoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/logo.png"
+        LogoHandler.requests = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def test_fetch_once_per_batch(self):
+        """The logo is downloaded once, then revalidated per batch"""
+        path = os.path.join(self.folder, "logo.png")
+        logo = LogoManager(self.url, path)
+        self.assertTrue(logo.ensure())
+        self.assertFalse(logo.ensure())
+        logo.start_batch()
+        self.assertFalse(logo.ensure())
+        self.assertEqual(LogoHandler.requests, [None, '"v1"'])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"logo")
+
+    def test_prepare_batch_revalidates(self):
+        """Each batch revalidates the logo, even on a cached page template"""
+        with open(os.path.join(self.folder, "logo_url.txt"), "w") as f:
+            f.write(self.url)
+        png = io.BytesIO()
+        Image.new("RGB", (40, 40), (200, 30, 30)).save(png, "PNG")
+        LogoHandler.body = png.getvalue()
+        self.addCleanup(setattr, LogoHandler, "body", b"logo")
+        branding = BrandingConfig(self.folder, self.folder)
+        with unittest.mock.patch.object(orders, "get_branding", return_value=branding):
+            for _ in range(3):
+                orders.prepare_batch(True)
+        self.assertEqual(LogoHandler.requests, [None, '"v1"', '"v1"'])
+        self.assertTrue(branding.has_main_logo())
+
+    def test_async_renderer_fetches_once(self):
+        """Async render workers use the logo fetched before they start"""
+        with open(os.path.join(self.folder, "logo_url.txt"), "w") as f:
+            f.write(self.url)
+        png = io.BytesIO()
+        Image.new("RGB", (40, 40), (200, 30, 30)).save(png, "PNG")
+        LogoHandler.body = png.getvalue()
+        self.addCleanup(setattr, LogoHandler, "body", b"logo")
+        branding = BrandingConfig(self.folder, self.folder)
+        invoices = get_invoice_objects(4)
+
+        async def render_all():
+            async with AsyncRenderer(max_concurrency=2) as renderer:
+                return await asyncio.gather(*(renderer.render(invoice) for invoice in invoices))
+
+        with unittest.mock.patch.object(orders, "get_branding", return_value=branding), \
+                unittest.mock.patch.object(invoice_pdf, "get_branding", return_value=branding):
+            pdfs = asyncio.run(render_all())
+        self.assertTrue(all(pdf.startswith(b"%PDF") for pdf in pdfs))
+        self.assertEqual(LogoHandler.requests, [None])
+
+    def test_unreachable_host(self):
+        """A failed download keeps the local logo"""
+        self.server.server_close()
+        logo = LogoManager(self.url, os.path.join(self.folder, "logo.png"), timeout=1)
+        self.assertFalse(logo.ensure())
+        self.assertTrue(logo.error)
+
+
+class TestRenderServer(unittest.TestCase):
+    """Test rendering invoices posted to the render server"""
+
+    payload = {
+        "customer": "Amy Jensen",
+        "invoice_date": "2022-05-31",
+        "orders": [
+            {"order_date": "2022-05-20", "product": "Milk", "price": "1.20", "quantity": 2},
+            {"order_date": "2022-05-22", "product": "Bread", "price": "1.10", "quantity": 1},
+        ],
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = RenderPool(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def serve(self, server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_http(self):
+        """Posted invoices are rendered, and bad payloads rejected"""
+        server = RenderServer(("127.0.0.1", 0), self.pool)
+        self.serve(server)
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(url + "/health") as response:
+            self.assertEqual(response.read(), b"ok\n")
+        body = json.dumps(self.payload).encode()
+        with urllib.request.urlopen(url + "/render", body) as response:
+            self.assertEqual(response.headers["Content-Type"], "application/pdf")
+            self.assertTrue(response.read().startswith(b"%PDF"))
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(url + "/render", b'{"customer": "Amy Jensen"}')
+        self.assertEqual(raised.exception.code, 400)
+
+    def test_unix_socket(self):
+        """Invoices can be rendered over a Unix socket"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "render.sock")
+        server = UnixRenderServer(path, self.pool)
+        self.serve(server)
+        body = json.dumps(self.payload).encode()
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(path)
+            sock.sendall(
+                b"POST /render HTTP/1.0\r\nContent-Length: %d\r\n\r\n" % len(body) + body
+            )
+            response = b"".join(iter(lambda: sock.recv(65536), b""))
+        head, pdf = response.split(b"\r\n\r\n", 1)
+        self.assertTrue(head.startswith(b"HTTP/1.0 200"))
+        self.assertTrue(pdf.startswith(b"%PDF"))
 
 
 if __name__ == "__main__":